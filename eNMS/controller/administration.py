@@ -1,8 +1,10 @@
 from passlib.hash import argon2
 from copy import deepcopy
 from ipaddress import IPv4Network
+from itertools import groupby
 from json import dump
 from logging import info
+from operator import itemgetter
 from os import listdir, makedirs, remove
 from os.path import exists, getmtime
 from pathlib import Path
@@ -21,6 +23,86 @@ from eNMS.models import relationships
 
 
 class AdministrationController(BaseController):
+    def archive_runs(self, before):
+        run, result, archived = models["run"], models["result"], 0
+        runtime_query = (
+            db.session.query(run.parent_runtime)
+            .filter(run.parent_runtime < before)
+            .distinct()
+            .order_by(run.parent_runtime)
+            .limit(db.bulk_chunk_size)
+        )
+        while True:
+            runtimes = [runtime for (runtime,) in runtime_query.all()]
+            if not runtimes:
+                return archived
+            for runtime in runtimes:
+                service_id = (
+                    db.session.query(run.service_id)
+                    .filter(run.runtime == runtime)
+                    .limit(1)
+                    .scalar()
+                )
+                service = db.fetch("service", allow_none=True, rbac=None, id=service_id)
+                archive = models["run_archive"](
+                    partition=runtime[:7],
+                    runtime=runtime,
+                    service=getattr(service, "name", None),
+                )
+                archive.write_content(self.get_archive_sections(runtime))
+                db.session.add(archive)
+            run_query = db.session.query(run.id).filter(
+                run.parent_runtime.in_(runtimes)
+            )
+            run_ids = [id for (id,) in run_query]
+            for chunk in db.chunks(run_ids):
+                db.session.query(run).filter(run.restart_run_id.in_(chunk)).update(
+                    {"restart_run_id": None}, synchronize_session=False
+                )
+            for model, field in (
+                (result, result.parent_runtime),
+                (models["service_log"], models["service_log"].runtime),
+                (run, run.parent_runtime),
+            ):
+                db.session.query(model).filter(field.in_(runtimes)).delete(
+                    synchronize_session=False
+                )
+            db.session.commit()
+            archived += len(runtimes)
+
+    def get_archive_sections(self, runtime):
+        for model, field in (
+            ("run", "parent_runtime"),
+            ("result", "parent_runtime"),
+            ("service_log", "runtime"),
+        ):
+            table = models[model].__table__
+            query = (
+                table.select()
+                .where(getattr(table.c, field) == runtime)
+                .execution_options(stream_results=True)
+            )
+            yield model, db.session.execute(query)
+
+    def get_archived_result(self, id, run=False):
+        archive_model = models["run_archive"]
+        model = "run" if run else "result"
+        first_id = getattr(archive_model, f"first_{model}_id")
+        last_id = getattr(archive_model, f"last_{model}_id")
+        archives = db.session.query(archive_model).filter(first_id <= id, last_id >= id)
+        for archive in archives:
+            data = archive.data
+            for result in data["results"]:
+                if (result["run_id"] if run else result["id"]) != id:
+                    continue
+                if run and result["device_id"] is not None:
+                    continue
+                if not db.get_rbac_user("service", "read") or db.fetch(
+                    "service", allow_none=True, id=result["service_id"]
+                ):
+                    return result
+                return
+
     def authenticate_user(self, **kwargs):
         name, password = kwargs["name"], kwargs["password"]
         if not name or not password:
@@ -88,6 +170,11 @@ class AdministrationController(BaseController):
     def get_migration_folders(self):
         return listdir(self.path / "files" / "migrations")
 
+    def get_query_statistics(self):
+        with db.query_statistics_lock:
+            statistics = list(db.query_statistics.items())
+        return dict(sorted(statistics, key=lambda item: -item[1]["time"]))
+
     def get_tree_files(self, path):
         if path == "root":
             path = self.settings["paths"]["files"] or self.path / "files"
@@ -131,6 +218,7 @@ class AdministrationController(BaseController):
                 if model == "workflow_edge":
                     workflow_edges = deepcopy(instances)
                     continue
+                rows = []
                 for instance in instances:
                     instance_type = (
                         instance.pop("type") if model == "service" else model
@@ -142,14 +230,14 @@ class AdministrationController(BaseController):
                         superworkflows[instance["name"]] = instance.pop("superworkflow")
                     if instance_type == "workflow":
                         workflow_services[instance["name"]] = instance.pop("services")
-                    try:
-                        instance = self.objectify(instance_type, instance)
-                        db.factory(
-                            instance_type, **{"dont_update_pools": True, **instance}
-                        )
-                        db.session.commit()
-                    except Exception:
-                        info(f"{str(instance)} could not be imported:\n{format_exc()}")
+                    rows.append(
+                        (instance_type, {"dont_update_pools": True, **instance})
+                    )
+                for instance_type, type_rows in groupby(rows, key=itemgetter(0)):
+                    type_rows = [row for _, row in type_rows]
+                    result = db.bulk_factory(instance_type, type_rows)
+                    for instance, error in result["failure"]:
+                        info(f"{str(instance)} could not be imported:\n{error}")
                         status = "Partial import (see logs)."
         try:
             for name, services in workflow_services.items():
@@ -206,13 +294,18 @@ class AdministrationController(BaseController):
     def result_log_deletion(self, **kwargs):
         date_time_object = datetime.strptime(kwargs["date_time"], "%d/%m/%Y %H:%M:%S")
         date_time_string = date_time_object.strftime("%Y-%m-%d %H:%M:%S.%f")
+        if kwargs.get("archive"):
+            self.archive_runs(date_time_string)
         for model in kwargs["deletion_types"]:
             if model == "run":
                 field_name = "runtime"
             elif model == "changelog":
                 field_name = "time"
+            cutoff = date_time_string
+            if model == "run_archive":
+                field_name, cutoff = "partition", date_time_string[:7]
             session_query = db.session.query(models[model]).filter(
-                getattr(models[model], field_name) < date_time_string
+                getattr(models[model], field_name) < cutoff
             )
             session_query.delete(synchronize_session=False)
             db.session.commit()
@@ -17,6 +17,7 @@ except ImportError as exc:
 
 from eNMS.controller.base import BaseController
 from eNMS.database import db
+from eNMS.models import models
 
 
 class AutomationController(BaseController):
@@ -80,8 +81,11 @@ class AutomationController(BaseController):
         workflow.services.append(db.fetch("service", id=service))
 
     def calendar_init(self, type):
-        results = {}
-        for instance in db.fetch_all(type):
+        results, query = {}, db.query(type)
+        if type == "run":
+            run = models["run"]
+            query = query.filter(run.workflow_id.is_(None), run.runtime.isnot(None))
+        for instance in query.all():
             if getattr(instance, "workflow", None):
                 continue
             date = getattr(instance, "next_run_time" if type == "task" else "runtime")
@@ -207,9 +211,16 @@ class AutomationController(BaseController):
         for parent_workflow in workflow.workflows:
             yield from self.get_parent_workflows(parent_workflow)
 
+    @db.read_only
     def get_result(self, id):
-        return db.fetch("result", id=id).result
-
+        if db.fetch("result", allow_none=True, rbac=None, id=id):
+            return db.fetch("result", id=id).result
+        archived_result = self.get_archived_result(int(id))
+        if not archived_result:
+            raise db.rbac_error
+        return archived_result["result"]
+
+    @db.read_only
     def get_runtimes(self, type, id):
         runs = db.fetch("run", allow_none=True, all_matches=True, service_id=id)
         return sorted(set((run.parent_runtime, run.parent_runtime) for run in runs))
@@ -229,6 +240,11 @@ class AutomationController(BaseController):
         service = db.fetch("service", id=service_id, allow_none=True)
         if not service:
             return {}
+        relations = ["services", "edges", "superworkflow"]
+        options = db.get_loader_options(service.type, relations=relations)
+        service = (
+            db.query(service.type).filter_by(id=service.id).options(*options).one()
+        )
         runs = db.fetch_all("run", service_id=service_id)
         if not runtime:
             runtime = "latest"
@@ -239,7 +255,7 @@ class AutomationController(BaseController):
             if latest_runs:
                 state = latest_runs[0].get_state()
         return {
-            "service": service.to_dict(include=["services", "edges", "superworkflow"]),
+            "service": service.to_dict(include=relations),
             "runtimes": sorted(set((r.parent_runtime, r.creator) for r in runs)),
             "state": state,
             "runtime": runtime,
@@ -431,7 +447,8 @@ class AutomationController(BaseController):
             run_kwargs["start_service"] = service.id
         run = db.factory("run", service=service.id, commit=True, **run_kwargs)
         run.properties = kwargs
-        return run.run({**initial_payload, **kwargs})
+        with db.monitor_queries(f"run/{run.runtime}"):
+            return run.run({**initial_payload, **kwargs})
 
     def run_service(self, path, **kwargs):
         service_id = str(path).split(">")[-1]
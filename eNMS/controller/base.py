@@ -1,5 +1,6 @@
+from atexit import register
 from base64 import b64decode, b64encode
-from collections import Counter
+from collections import Counter, OrderedDict
 from cryptography.fernet import Fernet
 from datetime import datetime
 from difflib import unified_diff
@@ -9,14 +10,16 @@ from email.mime.text import MIMEText
 from email.utils import formatdate
 from flask_login import current_user
 from git import Repo
+from hashlib import sha256
 from importlib import import_module
 from importlib.util import module_from_spec, spec_from_file_location
-from json import load
+from json import dumps, load
 from logging.config import dictConfig
 from logging import getLogger, error, info
-from os import environ, scandir
+from os import environ, getpid, scandir
 from os.path import exists
 from pathlib import Path
+from queue import Full, Queue
 from re import compile, error as regex_error
 from redis import Redis
 from redis.exceptions import ConnectionError, TimeoutError
@@ -26,10 +29,13 @@ from requests.packages.urllib3.util.retry import Retry
 from ruamel import yaml
 from smtplib import SMTP
 from string import punctuation
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, cast, or_, Text
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.orm import configure_mappers
+from sqlalchemy.types import JSON
 from sys import path as sys_path
+from threading import Lock, Thread
+from time import time
 from uuid import getnode
 from warnings import warn
 
@@ -67,6 +73,7 @@ class BaseController:
         self.path = Path.cwd()
         self.init_encryption()
         self.use_vault = settings["vault"]["use_vault"]
+        self.init_vault_cache()
         if self.use_vault:
             self.init_vault_client()
         if settings["syslog"]["active"]:
@@ -75,6 +82,8 @@ class BaseController:
             sys_path.append(settings["paths"]["custom_code"])
         self.fetch_version()
         self.init_logs()
+        self.init_changelog_writer()
+        self.count_cache, self.count_cache_lock = OrderedDict(), Lock()
         self.init_redis()
         self.init_scheduler()
         self.init_connection_pools()
@@ -102,8 +111,15 @@ class BaseController:
     def initialize_database(self):
         self.init_services()
         db.base.metadata.create_all(bind=db.engine)
+        db.convert_pickled_columns()
+        db.convert_datetime_columns()
+        db.create_missing_columns()
+        db.create_missing_indexes()
+        db.create_search_index(list(self.configuration_properties))
         configure_mappers()
+        db.update_coordinate_columns()
         db.configure_application_events(self)
+        self.start_changelog_writer()
         self.init_forms()
         if not db.fetch("user", allow_none=True, name="admin"):
             self.create_admin_user()
@@ -170,7 +186,7 @@ class BaseController:
                 self.property_names[property] = pretty_name
                 model_properties[model].append(property)
                 if property_dict.get("private"):
-                    db.private_properties.append(property)
+                    db.add_private_property(property)
                 if model == "device" and property_dict.get("configuration"):
                     self.configuration_properties[property] = pretty_name
 
@@ -242,6 +258,52 @@ class BaseController:
             keys = [environ.get(f"UNSEAL_VAULT_KEY{i}") for i in range(1, 6)]
             self.vault_client.sys.submit_unseal_keys(filter(None, keys))
 
+    def init_vault_cache(self):
+        cache_settings = self.settings["vault"]["cache"]
+        self.vault_cache_size = cache_settings["size"]
+        self.vault_cache_ttl = cache_settings["ttl"]
+        self.vault_cache = OrderedDict()
+        self.vault_cache_hits = self.vault_cache_misses = 0
+        self.vault_cache_lock = Lock()
+
+    def vault_cache_info(self):
+        return {
+            "hits": self.vault_cache_hits,
+            "misses": self.vault_cache_misses,
+            "size": len(self.vault_cache),
+        }
+
+    def cache_secret(self, path, value):
+        if not self.vault_cache_ttl:
+            return
+        with self.vault_cache_lock:
+            self.vault_cache[path] = (value, time() + self.vault_cache_ttl)
+            self.vault_cache.move_to_end(path)
+            while len(self.vault_cache) > self.vault_cache_size:
+                self.vault_cache.popitem(last=False)
+
+    def evict_secrets(self, prefix):
+        with self.vault_cache_lock:
+            for path in [path for path in self.vault_cache if path.startswith(prefix)]:
+                del self.vault_cache[path]
+
+    def vault_read(self, path, key):
+        with self.vault_cache_lock:
+            value, expiry = self.vault_cache.get(path, (None, 0))
+            if expiry > time():
+                self.vault_cache.move_to_end(path)
+                self.vault_cache_hits += 1
+                return value
+            self.vault_cache_misses += 1
+        data = self.vault_client.read(path)
+        value = data["data"]["data"][key] if data else ""
+        self.cache_secret(path, value)
+        return value
+
+    def vault_write(self, path, key, value):
+        self.vault_client.write(path, data={key: value})
+        self.cache_secret(path, value)
+
     def init_syslog_server(self):
         self.syslog_server = SyslogServer(
             self.settings["syslog"]["address"], self.settings["syslog"]["port"]
@@ -281,7 +343,10 @@ class BaseController:
         return db.fetch(model, id=id).get_properties()
 
     def get_all(self, model):
-        return [instance.get_properties() for instance in db.fetch_all(model)]
+        properties = db.get_serializer(model)[0]
+        query = db.load_properties(db.query(model), model, properties)
+        query = query.options(*db.get_loader_options(model, properties))
+        return [instance.get_properties() for instance in query.all()]
 
     def update(self, type, **kwargs):
         try:
@@ -304,21 +369,67 @@ class BaseController:
                 return {"alert": f"There is already a {type} with the same parameters."}
             return {"alert": str(exc)}
 
+    def init_changelog_writer(self):
+        self.changelog_pid, self.changelog_queue, self.changelog_writer = (
+            None,
+            None,
+            None,
+        )
+        self.changelog_lock, self.changelog_dropped = Lock(), 0
+        register(self.stop_changelog_writer)
+
+    def changelog_info(self):
+        return {
+            "dropped": self.changelog_dropped,
+            "queued": self.changelog_queue.qsize() if self.changelog_queue else 0,
+        }
+
+    def start_changelog_writer(self):
+        with self.changelog_lock:
+            if self.changelog_pid == getpid() and self.changelog_writer.is_alive():
+                return
+            if self.changelog_pid != getpid():
+                buffer_size = settings["database"]["changelog_buffer_size"]
+                self.changelog_queue = Queue(maxsize=buffer_size)
+                self.changelog_pid = getpid()
+            self.changelog_writer = Thread(
+                target=db.bulk_writer,
+                args=("changelog", self.changelog_queue),
+                daemon=True,
+            )
+            self.changelog_writer.start()
+
+    def flush_changelog(self):
+        if self.changelog_pid == getpid():
+            self.changelog_queue.join()
+
+    def stop_changelog_writer(self):
+        if self.changelog_pid == getpid() and self.changelog_writer.is_alive():
+            self.changelog_queue.put(None)
+            self.changelog_writer.join()
+
     def log(self, severity, content, user=None, change_log=True, logger="root"):
         logger_settings = self.logging["loggers"].get(logger, {})
         if logger:
             getattr(getLogger(logger), severity)(content)
         if change_log or logger and logger_settings.get("change_log"):
-            db.factory(
-                "changelog",
-                **{
-                    "severity": severity,
-                    "content": content,
-                    "user": user or getattr(current_user, "name", "admin"),
-                },
-            )
+            entry = {
+                "type": "changelog",
+                "time": str(datetime.now()),
+                "severity": severity,
+                "content": content,
+                "user": user or getattr(current_user, "name", "admin"),
+            }
+            if self.changelog_pid != getpid() or not self.changelog_writer.is_alive():
+                self.start_changelog_writer()
+            try:
+                self.changelog_queue.put_nowait(entry)
+            except Full:
+                with self.changelog_lock:
+                    self.changelog_dropped += 1
         return logger_settings
 
+    @db.read_only
     def count_models(self):
         return {
             "counters": {
@@ -357,16 +468,21 @@ class BaseController:
             if not value:
                 continue
             filter = kwargs["form"].get(f"{property}_filter")
+            column = getattr(table, property)
+            if isinstance(getattr(column, "type", None), (JSON, db.DateTime)):
+                column = cast(column, Text)
             if value in ("bool-true", "bool-false"):
-                constraint = getattr(table, property) == (value == "bool-true")
+                constraint = column == (value == "bool-true")
             elif filter == "equality":
-                constraint = getattr(table, property) == value
+                constraint = column == value
+            elif model == "device" and property in db.search_index_properties:
+                constraint = db.search_constraint(property, value)
             elif not filter or filter == "inclusion" or db.dialect == "sqlite":
-                constraint = getattr(table, property).contains(value)
+                constraint = column.contains(value)
             else:
                 compile(value)
                 regex_operator = "regexp" if db.dialect == "mysql" else "~"
-                constraint = getattr(table, property).op(regex_operator)(value)
+                constraint = column.op(regex_operator)(value)
             constraints.append(constraint)
         for related_model, relation_properties in relationships[model].items():
             relation_ids = [int(id) for id in kwargs["form"].get(related_model, [])]
@@ -403,40 +519,115 @@ class BaseController:
             "total_count": results.count(),
         }
 
+    def count_records(self, model, query):
+        key, now = (model, getattr(current_user, "name", None)), time()
+        ttl = settings["database"]["count_cache_ttl"]
+        with self.count_cache_lock:
+            timestamp, count = self.count_cache.get(key, (0, None))
+        if now - timestamp <= ttl:
+            return count
+        count = query.count()
+        with self.count_cache_lock:
+            self.count_cache[key] = (now, count)
+            self.count_cache.move_to_end(key)
+            while self.count_cache and (
+                len(self.count_cache) > settings["database"]["count_cache_size"]
+                or now - next(iter(self.count_cache.values()))[0] > ttl
+            ):
+                self.count_cache.popitem(last=False)
+        return count
+
+    @staticmethod
+    def filtering_signature(model, **kwargs):
+        ignored = ("count_filtered", "draw", "export", "keyset", "length", "start")
+        filters = {key: value for key, value in kwargs.items() if key not in ignored}
+        signature = dumps([model, filters], sort_keys=True, default=str)
+        return sha256(signature.encode("utf-8")).hexdigest()
+
+    def keyset_filter(self, table, property, direction, value, id):
+        column = getattr(table, property)
+        operator = "__gt__" if direction == "asc" else "__lt__"
+        constraint = or_(
+            getattr(column, operator)(value),
+            and_(column == value, getattr(table.id, operator)(id)),
+        )
+        if (direction == "asc") == (db.dialect == "postgresql"):
+            constraint = or_(constraint, column.is_(None))
+        return constraint
+
+    @staticmethod
+    def is_indexed(table, property):
+        column = getattr(getattr(table, property, None), "property", None)
+        if not hasattr(column, "columns"):
+            return False
+        return any(col.primary_key or col.index or col.unique for col in column.columns)
+
+    @db.read_only
     def filtering(self, model, **kwargs):
         table = models[model]
-        ordering = getattr(
-            getattr(
-                table,
-                kwargs["columns"][int(kwargs["order"][0]["column"])]["data"],
-                None,
-            ),
-            kwargs["order"][0]["dir"],
-            None,
-        )
+        property = kwargs["columns"][int(kwargs["order"][0]["column"])]["data"]
+        direction = kwargs["order"][0]["dir"]
+        ordering = getattr(getattr(table, property, None), direction, None)
         try:
             constraints = self.build_filtering_constraints(model, **kwargs)
         except regex_error:
             return {"error": "Invalid regular expression as search parameter."}
         constraints.extend(table.filtering_constraints(**kwargs))
         query = db.query(model)
-        total_records, query = query.count(), query.filter(and_(*constraints))
+        total_records = self.count_records(model, query)
+        query = query.filter(and_(*constraints))
         if ordering:
-            query = query.order_by(ordering())
+            query = query.order_by(ordering(), getattr(table.id, direction)())
+        start, length = int(kwargs["start"]), int(kwargs["length"])
+        keyset, seekable = kwargs.get("keyset") or {}, False
+        if ordering and self.is_indexed(table, property):
+            seekable = self.filtering_signature(model, **kwargs)
+        anchors = (
+            keyset.get("anchors", {}) if keyset.get("signature") == seekable else {}
+        )
+        anchor = max(
+            (int(index) for index in anchors if int(index) <= start), default=0
+        )
+        page, offset = query, start
+        if seekable and anchor:
+            value, id = anchors[str(anchor)]
+            page = page.filter(
+                self.keyset_filter(table, property, direction, value, id)
+            )
+            offset = start - anchor
+        if offset:
+            page = page.offset(offset)
+        if kwargs.get("rest_api_request"):
+            properties = [column["data"] for column in kwargs["columns"]]
+        else:
+            properties = db.get_serializer(model)[0]
+        properties = [*properties, *kwargs["form"], property]
+        page = db.load_properties(page, model, properties)
+        page = page.options(*db.get_loader_options(model, properties))
+        instances = page.limit(length).all()
         table_result = {
             "draw": int(kwargs["draw"]),
             "recordsTotal": total_records,
-            "recordsFiltered": query.count(),
-            "data": [
-                obj.table_properties(**kwargs)
-                for obj in query.limit(int(kwargs["length"]))
-                .offset(int(kwargs["start"]))
-                .all()
-            ],
+            "data": [obj.table_properties(**kwargs) for obj in instances],
         }
+        if not constraints:
+            table_result["recordsFiltered"] = total_records
+        elif kwargs.get("count_filtered", True):
+            table_result["recordsFiltered"] = query.count()
+        if seekable:
+            last_value = getattr(instances[-1], property) if instances else None
+            if last_value not in (None, ""):
+                anchors[str(start + len(instances))] = [last_value, instances[-1].id]
+            nearest_anchors = sorted(anchors, key=lambda index: abs(int(index) - start))
+            limit = settings["database"]["keyset_anchors"]
+            anchors = {index: anchors[index] for index in nearest_anchors[:limit]}
+            table_result["keyset"] = {"signature": seekable, "anchors": anchors}
         if kwargs.get("export"):
             table_result["full_result"] = [
-                obj.table_properties(**kwargs) for obj in query.all()
+                obj.table_properties(**kwargs)
+                for obj in db.load_properties(query, model, properties)
+                .options(*db.get_loader_options(model, properties))
+                .all()
             ]
         return table_result
 
@@ -521,7 +712,7 @@ class BaseController:
                 if not filepath.exists():
                     continue
                 with open(filepath) as file:
-                    setattr(device, data, file.read())
+                    device.update_configuration(data, file.read())
         db.session.commit()
         for pool in db.fetch_all("pool"):
             if any(
@@ -1,17 +1,24 @@
 from collections import Counter
+from csv import reader as csv_reader, writer as csv_writer
 from flask_login import current_user
 from git import Repo
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+from itertools import islice
+from json import dumps, loads
 from logging import info
 from os import environ
-from sqlalchemy import and_
+from re import match, sub
+from sqlalchemy import and_, cast, func, Integer, or_
+from sqlalchemy.orm import aliased
 from subprocess import Popen
 from threading import Thread
+from time import time
 from uuid import uuid4
 from werkzeug.utils import secure_filename
 from xlrd import open_workbook
-from xlrd.biffh import XLRDError
-from xlwt import Workbook
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+from zipfile import ZIP_DEFLATED, ZipFile
 
 
 from eNMS.controller.base import BaseController
@@ -20,10 +27,30 @@ from eNMS.database import db
 from eNMS.models import models, model_properties, property_types
 
 
+class ExportStream:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
 class InventoryController(BaseController):
 
     ssh_port = -1
     configuration_properties = {"configuration": "Configuration"}
+    import_jobs = {}
 
     def get_ssh_port(self):
         if self.redis_queue:
@@ -143,6 +170,29 @@ class InventoryController(BaseController):
         device = db.fetch("device", id=device_id)
         return {p: getattr(device, p) for p in self.configuration_properties}
 
+    def get_configuration_history(self, device_id):
+        version = models["configuration_version"]
+        versions = (
+            db.session.query(version)
+            .filter_by(device_id=db.fetch("device", id=device_id).id)
+            .order_by(version.runtime.desc(), version.id.desc())
+        )
+        history = {property: [] for property in self.configuration_properties}
+        for instance in versions:
+            history.setdefault(instance.property, []).append(
+                {
+                    "id": instance.id,
+                    "hash": instance.content.hash,
+                    "date": instance.runtime,
+                }
+            )
+        return history
+
+    def get_configuration_version(self, version_id):
+        version = db.fetch("configuration_version", id=version_id, rbac=None)
+        db.fetch("device", id=version.device_id)
+        return version.content.data
+
     def get_session_log(self, session_id):
         return db.fetch("session", id=session_id).content
 
@@ -151,57 +201,316 @@ class InventoryController(BaseController):
             str(getattr(instance, property)) for instance in db.fetch_all(type)
         )
 
+    def get_export_rows(self, model, private=True):
+        table, query = models[model], db.query(model)
+        columns = {
+            property: getattr(table, property)
+            for property in model_properties[model]
+            if property not in db.dont_migrate[model]
+            and (private or property not in db.private_properties)
+        }
+        if model == "link":
+            for node in ("source", "destination"):
+                device = aliased(models["device"], flat=True)
+                query = query.join(device, getattr(table, f"{node}_id") == device.id)
+                columns[f"{node}_name"] = device.name
+        properties = list(columns)
+        yield properties
+        total = query.count()
+        query = query.with_entities(*columns.values())
+        for index, row in enumerate(query.yield_per(db.bulk_chunk_size), 1):
+            values = dict(zip(properties, row))
+            for property, value in values.items():
+                if property in db.private_properties and self.use_vault:
+                    path = f"secret/data/{model}/{values['name']}/{property}"
+                    value = self.vault_read(path, property)
+                elif isinstance(value, bytes):
+                    value = str(self.decrypt(value), "utf-8")
+                values[property] = "" if value is None else str(value)
+            yield list(values.values())
+            if not index % db.bulk_chunk_size or index == total:
+                info(f"Topology export: {index}/{total} {model}s")
+
+    def stream_csv(self, model, private=True):
+        stream = ExportStream()
+        writer = csv_writer(stream)
+        for index, row in enumerate(self.get_export_rows(model, private), 1):
+            writer.writerow(row)
+            if not index % db.bulk_chunk_size:
+                yield stream.read()
+        yield stream.read()
+
+    def stream_xlsx(self, *models, private=True):
+        namespace = "http://schemas.openxmlformats.org"
+        content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+        relationship = f"{namespace}/officeDocument/2006/relationships"
+        header = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        invalid_xml = "[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]"
+        parts = {
+            "[Content_Types].xml": (
+                f'<Types xmlns="{namespace}/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/'
+                'vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                f'ContentType="{content_type}.sheet.main+xml"/>'
+                + "".join(
+                    f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+                    f'ContentType="{content_type}.worksheet+xml"/>'
+                    for index in range(1, len(models) + 1)
+                )
+                + "</Types>"
+            ),
+            "_rels/.rels": (
+                f'<Relationships xmlns="{namespace}/package/2006/relationships">'
+                f'<Relationship Id="rId1" Type="{relationship}/officeDocument" '
+                'Target="xl/workbook.xml"/></Relationships>'
+            ),
+            "xl/workbook.xml": (
+                f'<workbook xmlns="{namespace}/spreadsheetml/2006/main" '
+                f'xmlns:r="{relationship}"><sheets>'
+                + "".join(
+                    f'<sheet name="{model}" sheetId="{index}" r:id="rId{index}"/>'
+                    for index, model in enumerate(models, 1)
+                )
+                + "</sheets></workbook>"
+            ),
+            "xl/_rels/workbook.xml.rels": (
+                f'<Relationships xmlns="{namespace}/package/2006/relationships">'
+                + "".join(
+                    f'<Relationship Id="rId{index}" Type="{relationship}/worksheet" '
+                    f'Target="worksheets/sheet{index}.xml"/>'
+                    for index in range(1, len(models) + 1)
+                )
+                + "</Relationships>"
+            ),
+        }
+        stream = ExportStream()
+        with ZipFile(stream, "w", ZIP_DEFLATED) as workbook:
+            for path, content in parts.items():
+                workbook.writestr(path, header + content)
+            for index, model in enumerate(models, 1):
+                with workbook.open(f"xl/worksheets/sheet{index}.xml", "w") as sheet:
+                    sheet.write(
+                        f'{header}<worksheet xmlns="{namespace}/spreadsheetml/2006/'
+                        'main"><sheetData>'.encode("utf-8")
+                    )
+                    for row_index, row in enumerate(
+                        self.get_export_rows(model, private), 1
+                    ):
+                        values = (escape(sub(invalid_xml, "", value)) for value in row)
+                        cells = "".join(
+                            '<c t="inlineStr"><is><t xml:space="preserve">'
+                            f"{value}</t></is></c>"
+                            for value in values
+                        )
+                        sheet.write(f'<row r="{row_index}">{cells}</row>'.encode())
+                        if not row_index % db.bulk_chunk_size:
+                            yield stream.read()
+                    sheet.write(b"</sheetData></worksheet>")
+                yield stream.read()
+        yield stream.read()
+
+    def stream_topology(self, export_format="xlsx", model="device"):
+        if export_format == "csv":
+            return self.stream_csv(model, private=False)
+        return self.stream_xlsx("device", "link", private=False)
+
     def export_topology(self, **kwargs):
-        workbook = Workbook()
         filename = kwargs["export_filename"]
-        if "." not in filename:
-            filename += ".xls"
-        for obj_type in ("device", "link"):
-            sheet = workbook.add_sheet(obj_type)
-            for index, property in enumerate(model_properties[obj_type]):
-                if property in db.dont_migrate[obj_type]:
-                    continue
-                sheet.write(0, index, property)
-                for obj_index, obj in enumerate(db.fetch_all(obj_type), 1):
-                    value = getattr(obj, property)
-                    if type(value) == bytes:
-                        value = str(self.decrypt(value), "utf-8")
-                    sheet.write(obj_index, index, str(value))
-        workbook.save(self.path / "files" / "spreadsheets" / filename)
-
-    def topology_import(self, file):
-        book = open_workbook(file_contents=file.read())
-        status = "Topology successfully imported."
-        for obj_type in ("device", "link"):
-            try:
-                sheet = book.sheet_by_name(obj_type)
-            except XLRDError:
+        stem, export_format = (
+            filename.rsplit(".", 1) if "." in filename else (filename, "")
+        )
+        path = self.path / "files" / "spreadsheets"
+        if export_format == "csv":
+            for model in ("device", "link"):
+                with open(path / f"{stem}_{model}.csv", "wb") as file:
+                    for chunk in self.stream_csv(model):
+                        file.write(chunk)
+        else:
+            with open(path / f"{stem}.xlsx", "wb") as file:
+                for chunk in self.stream_xlsx("device", "link"):
+                    file.write(chunk)
+
+    def get_import_job(self, job_id):
+        if self.redis_queue:
+            job = self.redis("get", f"import_jobs/{job_id}")
+            return loads(job) if job else None
+        job, expiry = self.import_jobs.get(job_id, (None, 0))
+        return job if expiry > time() else None
+
+    def update_import_job(self, job_id, **kwargs):
+        job = {**(self.get_import_job(job_id) or {}), **kwargs}
+        ttl = self.settings["database"]["import_job_ttl"]
+        if self.redis_queue:
+            self.redis("set", f"import_jobs/{job_id}", dumps(job), ex=ttl)
+        else:
+            for expired_job_id, (_, expiry) in list(self.import_jobs.items()):
+                if expiry < time():
+                    self.import_jobs.pop(expired_job_id, None)
+            self.import_jobs[job_id] = (job, time() + ttl)
+
+    def get_xlsx_rows(self, file, strings):
+        namespace = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+        for _, element in iterparse(file):
+            if element.tag != f"{namespace}row":
                 continue
-            properties = sheet.row_values(0)
-            for row_index in range(1, sheet.nrows):
-                values = {"dont_update_pools": True}
-                for index, property in enumerate(properties):
-                    if not property:
-                        continue
-                    func = db.field_conversion[property_types.get(property, "str")]
-                    values[property] = func(sheet.row_values(row_index)[index])
-                try:
-                    db.factory(obj_type, **values).serialized
-                except Exception as exc:
-                    info(f"{str(values)} could not be imported ({str(exc)})")
-                    status = "Partial import (see logs)."
-            db.session.commit()
-        for pool in db.fetch_all("pool"):
-            pool.compute_pool()
-        self.log("info", status)
+            row = []
+            for cell in element.iter(f"{namespace}c"):
+                reference = match("[A-Z]+", cell.get("r", ""))
+                if reference:
+                    column = 0
+                    for letter in reference.group():
+                        column = column * 26 + ord(letter) - 64
+                    row.extend([""] * (column - 1 - len(row)))
+                if cell.get("t") == "inlineStr":
+                    texts = cell.iter(f"{namespace}t")
+                    value = "".join(text.text or "" for text in texts)
+                else:
+                    value = cell.findtext(f"{namespace}v") or ""
+                    if value and cell.get("t") == "s":
+                        value = strings[int(value)]
+                    elif value and cell.get("t") == "b":
+                        value = str(value == "1")
+                row.append(value)
+            element.clear()
+            yield row
+
+    def get_xlsx_sheets(self, file):
+        namespace = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+        relationship = "{http://schemas.openxmlformats.org/officeDocument/2006/"
+        with ZipFile(file) as workbook:
+            strings = []
+            if "xl/sharedStrings.xml" in workbook.namelist():
+                with workbook.open("xl/sharedStrings.xml") as shared_strings:
+                    for _, element in iterparse(shared_strings):
+                        if element.tag != f"{namespace}si":
+                            continue
+                        texts = element.iter(f"{namespace}t")
+                        strings.append("".join(text.text or "" for text in texts))
+                        element.clear()
+            with workbook.open("xl/_rels/workbook.xml.rels") as relationships:
+                targets = {
+                    element.get("Id"): element.get("Target")
+                    for _, element in iterparse(relationships)
+                }
+            with workbook.open("xl/workbook.xml") as workbook_file:
+                sheets = {
+                    element.get("name"): targets[
+                        element.get(f"{relationship}relationships}}id")
+                    ]
+                    for _, element in iterparse(workbook_file)
+                    if element.tag == f"{namespace}sheet"
+                }
+            for model in ("device", "link"):
+                if model not in sheets:
+                    continue
+                target = sheets[model]
+                path = target[1:] if target.startswith("/") else f"xl/{target}"
+                with workbook.open(path) as sheet:
+                    yield model, self.get_xlsx_rows(sheet, strings)
+
+    def get_import_sheets(self, file):
+        filename = str(getattr(file, "filename", file.name))
+        stream, extension = getattr(file, "stream", file), filename.rsplit(".")[-1]
+        if extension.lower() == "csv":
+            model = "link" if filename[:-4].endswith("_link") else "device"
+            text = TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+            yield model, csv_reader(text)
+        elif extension.lower() == "xlsx":
+            yield from self.get_xlsx_sheets(stream)
+        else:
+            book = open_workbook(file_contents=stream.read(), on_demand=True)
+            for model in ("device", "link"):
+                if model in book.sheet_names():
+                    sheet = book.sheet_by_name(model)
+                    yield model, (sheet.row_values(row) for row in range(sheet.nrows))
+
+    def get_import_converters(self, properties):
+        conversion = {
+            **db.field_conversion,
+            "bool": lambda value: str(value).lower() in ("true", "1", "1.0"),
+            "list": db.dict_conversion,
+        }
+        return [
+            (index, property, conversion[property_types.get(property, "str")])
+            for index, property in enumerate(properties)
+            if property
+        ]
+
+    def topology_import(self, file, job_id=None):
+        job_id, errors = job_id or str(uuid4()), []
+        self.update_import_job(job_id, status="Running", progress={}, errors=errors)
+        try:
+            progress, device_ids = {}, None
+            for model, rows in self.get_import_sheets(file):
+                header = next(rows, [])
+                converters = self.get_import_converters(
+                    [str(key).strip() for key in header]
+                )
+                if model == "link" and device_ids is None:
+                    device = models["device"]
+                    device_query = db.query("device").with_entities(
+                        device.name, device.id
+                    )
+                    device_ids = {"device": dict(device_query.all())}
+                progress[model], row_index = 0, 1
+                for chunk in iter(lambda: list(islice(rows, db.bulk_chunk_size)), []):
+                    values, positions = [], {}
+                    for row_index, row in enumerate(chunk, row_index + 1):
+                        try:
+                            row_values = {
+                                "dont_update_pools": True,
+                                **{
+                                    property: function(row[index])
+                                    for index, property, function in converters
+                                    if index < len(row) and row[index] != ""
+                                },
+                            }
+                        except Exception as exc:
+                            error = f"Invalid value ({exc})"
+                            errors.append(
+                                {"model": model, "row": row_index, "error": error}
+                            )
+                            continue
+                        positions[id(row_values)] = row_index
+                        values.append(row_values)
+                    result = db.bulk_factory(model, values, ids=device_ids)
+                    for row, error in result["failure"]:
+                        info(f"{str(row)} could not be imported ({error})")
+                        errors.append(
+                            {
+                                "model": model,
+                                "row": positions.get(id(row)),
+                                "name": row.get("name"),
+                                "error": error.strip().splitlines()[-1],
+                            }
+                        )
+                    progress[model] += len(chunk)
+                    info(f"Topology import: {progress[model]} {model}s processed")
+                    self.update_import_job(job_id, progress=progress, errors=errors)
+            self.update_all_pools()
+            status = (
+                "Partial import (see logs)."
+                if errors
+                else "Topology successfully imported."
+            )
+            self.update_import_job(job_id, status=status)
+            self.log("info", status)
+        except Exception as exc:
+            self.update_import_job(job_id, status="Failed", error=str(exc))
+            raise
         return status
 
     def import_topology(self, **kwargs):
         file = kwargs["file"]
+        if not self.allowed_file(
+            secure_filename(file.filename), {"csv", "xls", "xlsx"}
+        ):
+            return "Topology import: unsupported file format."
         if kwargs["replace"]:
             db.delete_all("device")
-        if self.allowed_file(secure_filename(file.filename), {"xls", "xlsx"}):
-            result = self.topology_import(file)
+        result = self.topology_import(file, kwargs.get("job_id"))
         info("Inventory import: Done.")
         return result
 
@@ -210,15 +519,16 @@ class InventoryController(BaseController):
         for obj_type in ("device", "link"):
             string_objects = kwargs[f"string_{obj_type}s"]
             if string_objects:
-                objects = []
-                for name in [obj.strip() for obj in string_objects.split(",")]:
-                    obj = db.fetch(obj_type, allow_none=True, name=name)
-                    if not obj:
-                        return {
-                            "alert": f"{obj_type.capitalize()} '{name}' does not exist."
-                        }
-                    if obj not in objects:
-                        objects.append(obj)
+                names = list(
+                    dict.fromkeys(obj.strip() for obj in string_objects.split(","))
+                )
+                objects = db.objectify(obj_type, names, key="name", allow_none=True)
+                if len(objects) != len(names):
+                    found = {obj.name for obj in objects}
+                    name = next(name for name in names if name not in found)
+                    return {
+                        "alert": f"{obj_type.capitalize()} '{name}' does not exist."
+                    }
             else:
                 objects = db.objectify(obj_type, kwargs[f"{obj_type}s"])
             setattr(pool, f"{obj_type}_number", len(objects))
@@ -233,19 +543,104 @@ class InventoryController(BaseController):
         for pool in db.fetch_all("pool"):
             pool.compute_pool()
 
-    def get_view_topology(self):
-        return {
-            "devices": [d.view_properties for d in db.fetch_all("device")],
-            "links": [d.view_properties for d in db.fetch_all("link")],
-        }
+    @db.read_only
+    def get_view_topology(self, **kwargs):
+        return self.view_filtering(**kwargs)
 
-    def view_filtering(self, **kwargs):
+    def get_view_constraints(self, bounds, *tables):
+        south, west, north, east = (
+            float(bounds[direction]) for direction in ("south", "west", "north", "east")
+        )
+        constraints = [
+            or_(*(table.latitude_value >= south for table in tables)),
+            or_(*(table.latitude_value <= north for table in tables)),
+        ]
+        if east - west >= 360:
+            return constraints
+        west, east = ((west + 180) % 360 - 180), ((east + 180) % 360 - 180)
+        if west <= east:
+            constraints.extend(
+                (
+                    or_(*(table.longitude_value >= west for table in tables)),
+                    or_(*(table.longitude_value <= east for table in tables)),
+                )
+            )
+        else:
+            constraints.append(
+                or_(
+                    *(table.longitude_value >= west for table in tables),
+                    *(table.longitude_value <= east for table in tables),
+                )
+            )
+        return constraints
+
+    def get_view_clusters(self, query, zoom):
+        device = models["device"]
+        cell_size = 360 * self.settings["view"]["cluster_size"] / (256 * 2 ** zoom)
+        clusters = query.with_entities(
+            func.count(device.id),
+            func.avg(device.latitude_value),
+            func.avg(device.longitude_value),
+        ).group_by(
+            cast((device.latitude_value + 90) / cell_size, Integer),
+            cast((device.longitude_value + 180) / cell_size, Integer),
+        )
+        return [
+            {"count": count, "latitude": latitude, "longitude": longitude}
+            for count, latitude, longitude in clusters.all()
+        ]
+
+    @db.read_only
+    def view_filtering(self, bounds=None, zoom=None, **kwargs):
+        device, link = models["device"], models["link"]
+        source, destination = aliased(device, flat=True), aliased(device, flat=True)
+        constraints = {
+            model: self.build_filtering_constraints(
+                model, **kwargs.get(model, {"form": {}})
+            )
+            for model in ("device", "link")
+        }
+        if bounds:
+            constraints["device"].extend(self.get_view_constraints(bounds, device))
+            constraints["link"].extend(
+                self.get_view_constraints(bounds, source, destination)
+            )
+        devices = db.query("device").filter(and_(*constraints["device"]))
+        if zoom is not None and int(zoom) < self.settings["view"]["cluster_zoom_level"]:
+            clusters = self.get_view_clusters(devices, int(zoom))
+            return {"clusters": clusters, "devices": [], "links": []}
+        devices = devices.with_entities(
+            *(getattr(device, property) for property in ("id", "type", "name", "icon")),
+            device.latitude_value.label("latitude"),
+            device.longitude_value.label("longitude"),
+            device.last_runtime,
+        )
+        links = (
+            db.query("link")
+            .join(source, link.source_id == source.id)
+            .join(destination, link.destination_id == destination.id)
+            .filter(and_(*constraints["link"]))
+            .with_entities(
+                *(
+                    getattr(link, property)
+                    for property in ("id", "type", "name", "color")
+                ),
+                *(
+                    getattr(node, property).label(f"{prefix}_{label}")
+                    for prefix, node in (
+                        ("source", source),
+                        ("destination", destination),
+                    )
+                    for property, label in (
+                        ("id", "id"),
+                        ("latitude_value", "latitude"),
+                        ("longitude_value", "longitude"),
+                    )
+                ),
+            )
+        )
         return {
-            obj_type: [
-                d.view_properties
-                for d in db.session.query(models[obj_type])
-                .filter(and_(*self.build_filtering_constraints(obj_type, **form)))
-                .all()
-            ]
-            for obj_type, form in kwargs.items()
+            "clusters": [],
+            "devices": [row._asdict() for row in devices.all()],
+            "links": [row._asdict() for row in links.all()],
         }
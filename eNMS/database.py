@@ -1,31 +1,58 @@
 from ast import literal_eval
+from collections import Counter, defaultdict, OrderedDict
 from contextlib import contextmanager
+from datetime import datetime
+from flask import has_request_context, session as user_session
 from flask_login import current_user
-from json import loads
-from logging import error
+from functools import wraps
+from heapq import heappush, heappushpop, nlargest
+from json import dumps, loads
+from logging import error, info, warning
 from os import environ
+from pickle import loads as unpickle
+from queue import Queue
+from re import search
 from sqlalchemy import (
     Boolean,
     Column,
     create_engine,
+    DateTime,
     event,
     ForeignKey,
     Float,
+    func,
     inspect,
     Integer,
-    PickleType,
+    LargeBinary,
+    or_,
     String,
     Table,
     Text,
 )
-from sqlalchemy.dialects.mysql.base import MSMediumBlob
+from sqlalchemy.dialects.mysql import DATETIME, LONGBLOB
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.associationproxy import ASSOCIATION_PROXY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict, MutableList
-from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy.types import JSON
+from sqlalchemy.orm import (
+    ColumnProperty,
+    deferred,
+    joinedload,
+    load_only,
+    object_session,
+    scoped_session,
+    selectin_polymorphic,
+    selectinload,
+    Session,
+    sessionmaker,
+)
+from sqlalchemy.sql import literal_column, select, text
+from sqlalchemy.types import _Binary, JSON, TypeDecorator
 from sqlalchemy.orm.collections import InstrumentedList
-from time import sleep
+from sqlite3 import sqlite_version, sqlite_version_info
+from threading import Event, local, Lock, RLock, Thread
+from time import perf_counter, sleep, time
+from traceback import format_exc
 
 from eNMS.models import model_properties, models, property_types, relationships
 from eNMS.setup import database as database_settings, properties, settings
@@ -39,8 +66,12 @@ class Database:
         self.dialect = self.database_url.split(":")[0]
         self.rbac_error = type("RbacError", (Exception,), {})
         self.configure_columns()
-        self.engine = self.configure_engine()
-        self.session = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        self.configure_write_serializer()
+        self.engine = self.configure_engine(self.database_url)
+        self.configure_read_replica()
+        self.session = scoped_session(
+            sessionmaker(autoflush=False, bind=self.engine, class_=self.RoutingSession)
+        )
         self.base = declarative_base()
         self.configure_associations()
         self.configure_events()
@@ -58,6 +89,16 @@ class Database:
         for retry_type, values in settings["database"]["retry"].items():
             for parameter, number in values.items():
                 setattr(self, f"retry_{retry_type}_{parameter}", number)
+        self.bulk_chunk_size = settings["database"]["bulk_chunk_size"]
+        self.tracked_properties, self.serializers, self.loader_options = {}, {}, {}
+        self.serializer_cache_size = settings["database"]["serializer_cache_size"]
+        self.search_index_properties = set()
+        self.configuration_history_size = settings["database"][
+            "configuration_history_size"
+        ]
+        self.configure_fetch_cache()
+        self.configure_pool_index()
+        self.configure_query_monitoring()
 
     @staticmethod
     def dict_conversion(input):
@@ -66,9 +107,62 @@ class Database:
         except Exception:
             return loads(input)
 
-    def configure_engine(self):
+    def configure_read_replica(self):
+        self.read_database_url = environ.get("DATABASE_READ_URL")
+        self.read_engine = None
+        if self.read_database_url:
+            self.read_engine = self.configure_engine(self.read_database_url)
+        self.replica_lag = settings["database"]["replica_lag"]
+        self.read_only_context = local()
+        database = self
+
+        class RoutingSession(Session):
+            def get_bind(self, mapper=None, clause=None):
+                if (
+                    database.read_engine
+                    and getattr(database.read_only_context, "active", False)
+                    and not self._flushing
+                ):
+                    return database.read_engine
+                return super().get_bind(mapper=mapper, clause=clause)
+
+            def flush(self, objects=None):
+                with database.serialized_write():
+                    super().flush(objects)
+
+            def commit(self):
+                with database.serialized_write():
+                    super().commit()
+
+        @event.listens_for(RoutingSession, "after_flush")
+        def record_write(session, flush_context):
+            if self.read_engine and has_request_context():
+                user_session["last_write"] = time()
+
+        self.RoutingSession = RoutingSession
+
+    def read_only(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.read_engine or self.recent_write():
+                return function(*args, **kwargs)
+            self.read_only_context.active = True
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.read_only_context.active = False
+
+        return wrapper
+
+    def recent_write(self):
+        if not has_request_context():
+            return False
+        return time() - user_session.get("last_write", 0) < self.replica_lag
+
+    def configure_engine(self, url):
         engine_parameters = {
             "convert_unicode": True,
+            "json_serializer": lambda value: dumps(value, default=str),
             "pool_pre_ping": True,
             "pool_recycle": 3600,
         }
@@ -82,21 +176,102 @@ class Database:
             )
         elif self.dialect == "sqlite":
             engine_parameters["connect_args"] = {"check_same_thread": False}
-        return create_engine(self.database_url, **engine_parameters)
+        engine = create_engine(url, **engine_parameters)
+        if self.dialect == "sqlite":
+            self.configure_sqlite_engine(engine)
+        return engine
 
-    def configure_columns(self):
-        class CustomPickleType(PickleType):
-            if self.dialect == "mysql":
-                impl = MSMediumBlob
+    def configure_sqlite_engine(self, engine):
+        sqlite_settings = settings["database"]["sqlite"]
+        write_statements = ("ALTER", "CREATE", "DELETE", "DROP", "INSERT", "UPDATE")
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(connection, connection_record):
+            cursor = connection.cursor()
+            for pragma in ("busy_timeout", "journal_mode", "synchronous"):
+                value = str(sqlite_settings[pragma]).lower()
+                current_value = cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+                if str(current_value).lower() == value:
+                    continue
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+            cursor.close()
+            connection.create_function("regexp", 2, self.regexp_match)
+
+        if not self.write_serializer:
+            return
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def track_writes(conn, cursor, statement, parameters, context, many):
+            if statement.lstrip()[:6].upper().startswith(write_statements):
+                self.write_context.pending = True
+
+        @event.listens_for(engine, "commit")
+        @event.listens_for(engine, "rollback")
+        def clear_writes(conn):
+            self.write_context.pending = False
+
+    @contextmanager
+    def serialized_write(self):
+        if not self.write_serializer or getattr(self.write_context, "pending", False):
+            yield
+            return
+        if not self.write_lock.acquire(timeout=self.write_lock_timeout):
+            raise TimeoutError("Timed out waiting for the database write lock.")
+        try:
+            yield
+        finally:
+            self.write_lock.release()
 
-        self.Dict = MutableDict.as_mutable(CustomPickleType)
-        self.List = MutableList.as_mutable(CustomPickleType)
+    @staticmethod
+    def regexp_match(pattern, value):
+        return value is not None and bool(search(pattern, str(value)))
+
+    @staticmethod
+    def coordinate(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def configure_write_serializer(self):
+        sqlite_settings = settings["database"]["sqlite"]
+        self.write_serializer = (
+            self.dialect == "sqlite" and sqlite_settings["write_serializer"]
+        )
+        self.write_lock, self.write_thread_lock = RLock(), Lock()
+        self.write_context = local()
+        self.write_lock_timeout = sqlite_settings["busy_timeout"] / 1000
+        self.write_queue, self.write_thread = Queue(), None
+
+    def configure_columns(self):
+        json_type = JSONB if self.dialect == "postgresql" else JSON
+        self.Dict = MutableDict.as_mutable(json_type)
+        self.List = MutableList.as_mutable(json_type)
         if self.dialect == "postgresql":
             self.LargeString = Text
         else:
             self.LargeString = Text(settings["database"]["large_string_length"])
         self.SmallString = String(settings["database"]["small_string_length"])
         self.TinyString = String(settings["database"]["tiny_string_length"])
+        self.LargeBinary = LONGBLOB if self.dialect == "mysql" else LargeBinary
+
+        class DateTimeString(TypeDecorator):
+            impl = DateTime
+
+            def load_dialect_impl(self, dialect):
+                if dialect.name == "mysql":
+                    return dialect.type_descriptor(DATETIME(fsp=6))
+                return dialect.type_descriptor(DateTime())
+
+            def process_bind_param(self, value, dialect):
+                if isinstance(value, str):
+                    return datetime.fromisoformat(value) if value else None
+                return value
+
+            def process_result_value(self, value, dialect):
+                return value.strftime("%Y-%m-%d %H:%M:%S.%f") if value else ""
+
+        self.DateTime = DateTimeString
 
         default_ctypes = {
             self.Dict: {},
@@ -115,26 +290,236 @@ class Database:
 
         self.Column = CustomColumn
 
+    def configure_fetch_cache(self):
+        cache_settings = settings["database"]["fetch_cache"]
+        self.fetch_cache_properties = set(cache_settings["properties"])
+        self.fetch_cache_size = cache_settings["size"]
+        self.fetch_cache, self.fetch_cache_keys = OrderedDict(), defaultdict(set)
+        self.fetch_cache_hits = self.fetch_cache_misses = 0
+        self.fetch_cache_lock = Lock()
+
+        @event.listens_for(self.base, "after_update", propagate=True)
+        @event.listens_for(self.base, "after_delete", propagate=True)
+        def flag_cached_instance(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault("fetch_cache_evictions", set()).add(target.id)
+
+        @event.listens_for(self.session, "after_commit")
+        def evict_cached_instances(session):
+            for id in session.info.pop("fetch_cache_evictions", ()):
+                self.evict_from_cache(id)
+
+        @event.listens_for(self.session, "after_soft_rollback")
+        def discard_cache_evictions(session, previous_transaction):
+            session.info.pop("fetch_cache_evictions", None)
+
+    def configure_pool_index(self):
+        self.pool_index, self.pool_index_signature = {}, None
+        self.pool_index_lock = Lock()
+        criteria = {"manually_defined", "operator"} | {
+            f"{model}_{property}{suffix}"
+            for model, model_properties in properties["filtering"].items()
+            for property in model_properties
+            for suffix in ("", "_match")
+        }
+
+        @event.listens_for(self.base, "after_insert", propagate=True)
+        @event.listens_for(self.base, "after_update", propagate=True)
+        @event.listens_for(self.base, "after_delete", propagate=True)
+        def flag_pool_index(mapper, connection, target):
+            if target.__tablename__ != "pool":
+                return
+            state = inspect(target)
+            if not state.deleted and not any(
+                state.attrs[property].history.has_changes() for property in criteria
+            ):
+                return
+            session = object_session(target)
+            if session is not None:
+                session.info["pool_index_stale"] = True
+
+        @event.listens_for(self.session, "after_commit")
+        def reset_pool_index(session):
+            if session.info.pop("pool_index_stale", False):
+                with self.pool_index_lock:
+                    self.pool_index = {}
+
+        @event.listens_for(self.session, "after_soft_rollback")
+        def discard_pool_index_flag(session, previous_transaction):
+            session.info.pop("pool_index_stale", None)
+
+    def get_pool_index(self, object_type):
+        pool = models["pool"]
+        signature = tuple(
+            self.session.query(func.count(pool.id), func.max(pool.last_modified)).one()
+        )
+        with self.pool_index_lock:
+            if signature != self.pool_index_signature:
+                self.pool_index, self.pool_index_signature = {}, signature
+            if object_type not in self.pool_index:
+                self.pool_index[object_type] = self.build_pool_index(object_type)
+            return self.pool_index[object_type]
+
+    def build_pool_index(self, object_type):
+        pool, index = models["pool"], {"pools": {}, "properties": defaultdict(set)}
+        query = self.session.query(pool).filter(pool.manually_defined.isnot(True))
+        for instance in query.all():
+            criteria = instance.criteria(object_type)
+            if not criteria:
+                continue
+            index["pools"][instance.id] = (instance.operator, criteria)
+            for property, *_ in criteria:
+                index["properties"][property].add(instance.id)
+        return index
+
+    def fetch_cache_info(self):
+        return {
+            "hits": self.fetch_cache_hits,
+            "misses": self.fetch_cache_misses,
+            "size": len(self.fetch_cache),
+        }
+
+    def fetch_from_cache(self, model, key):
+        with self.fetch_cache_lock:
+            id = self.fetch_cache.get(key)
+            if id is None:
+                self.fetch_cache_misses += 1
+                return
+            self.fetch_cache.move_to_end(key)
+        instance = self.session.query(models[model]).get(id)
+        if instance is None or str(getattr(instance, key[1])) != str(key[2]):
+            self.evict_from_cache(id)
+            with self.fetch_cache_lock:
+                self.fetch_cache_misses += 1
+            return
+        with self.fetch_cache_lock:
+            self.fetch_cache_hits += 1
+        return instance
+
+    def add_to_cache(self, key, id):
+        with self.fetch_cache_lock:
+            self.fetch_cache[key] = id
+            self.fetch_cache.move_to_end(key)
+            self.fetch_cache_keys[id].add(key)
+            while len(self.fetch_cache) > self.fetch_cache_size:
+                evicted_key, evicted_id = self.fetch_cache.popitem(last=False)
+                self.fetch_cache_keys[evicted_id].discard(evicted_key)
+                if not self.fetch_cache_keys[evicted_id]:
+                    del self.fetch_cache_keys[evicted_id]
+
+    def evict_from_cache(self, id):
+        with self.fetch_cache_lock:
+            for key in self.fetch_cache_keys.pop(id, ()):
+                self.fetch_cache.pop(key, None)
+
+    def configure_query_monitoring(self):
+        self.query_monitoring = settings["database"]["query_monitoring"]
+        self.query_statistics, self.query_frames = OrderedDict(), local()
+        self.query_statistics_lock = Lock()
+        if not self.query_monitoring["active"]:
+            return
+
+        def start_query_timer(connection, cursor, statement, parameters, context, _):
+            context.query_start = perf_counter()
+
+        def record_query(connection, cursor, statement, parameters, context, _):
+            duration = perf_counter() - context.query_start
+            slow_query_number = self.query_monitoring["slow_query_number"]
+            for frame in getattr(self.query_frames, "stack", []):
+                frame["queries"] += 1
+                frame["time"] += duration
+                frame["statements"][statement] += 1
+                if len(frame["slowest"]) < slow_query_number:
+                    heappush(frame["slowest"], (duration, statement))
+                else:
+                    heappushpop(frame["slowest"], (duration, statement))
+
+        for engine in filter(None, (self.engine, self.read_engine)):
+            event.listen(engine, "before_cursor_execute", start_query_timer)
+            event.listen(engine, "after_cursor_execute", record_query)
+
+    @contextmanager
+    def monitor_queries(self, name):
+        if not hasattr(self.query_frames, "stack"):
+            self.query_frames.stack = []
+        frame = {"queries": 0, "time": 0.0, "statements": Counter(), "slowest": []}
+        self.query_frames.stack.append(frame)
+        try:
+            yield frame
+        finally:
+            self.query_frames.stack.remove(frame)
+            self.record_query_statistics(name, frame)
+
+    def query_summary(self, frame=None):
+        if not frame:
+            stack = getattr(self.query_frames, "stack", None)
+            if not stack:
+                return {}
+            frame = stack[-1]
+        threshold = self.query_monitoring["n_plus_one_threshold"]
+        return {
+            "queries": frame["queries"],
+            "time": round(frame["time"], 6),
+            "slowest": [
+                {"duration": round(duration, 6), "statement": statement}
+                for duration, statement in nlargest(
+                    len(frame["slowest"]), frame["slowest"]
+                )
+            ],
+            "n_plus_one": {
+                statement: count
+                for statement, count in frame["statements"].items()
+                if count >= threshold
+            },
+        }
+
+    def record_query_statistics(self, name, frame):
+        summary = self.query_summary(frame)
+        with self.query_statistics_lock:
+            statistics = self.query_statistics.pop(name, None) or {
+                "calls": 0,
+                "queries": 0,
+                "time": 0.0,
+                "slowest": [],
+                "n_plus_one": {},
+            }
+            self.query_statistics[name] = statistics
+            statistics["calls"] += 1
+            statistics["queries"] += summary["queries"]
+            statistics["time"] = round(statistics["time"] + summary["time"], 6)
+            statistics["slowest"] = nlargest(
+                self.query_monitoring["slow_query_number"],
+                statistics["slowest"] + summary["slowest"],
+                key=lambda query: query["duration"],
+            )
+            for statement, count in summary["n_plus_one"].items():
+                n_plus_one = statistics["n_plus_one"]
+                n_plus_one[statement] = max(count, n_plus_one.get(statement, 0))
+            while len(self.query_statistics) > self.query_monitoring["history_size"]:
+                self.query_statistics.popitem(last=False)
+
     def configure_events(self):
         @event.listens_for(self.base, "mapper_configured", propagate=True)
         def model_inspection(mapper, model):
             name = model.__tablename__
+            for property in self.private_properties:
+                model.configure_private_property(property)
             for col in inspect(model).columns:
                 if not col.info.get("model_properties", True):
                     continue
                 model_properties[name].append(col.key)
-                if col.type == PickleType and isinstance(col.default.arg, list):
-                    property_types[col.key] = "list"
+                if isinstance(col.type, JSON):
+                    is_list = col.default and isinstance(col.default.arg, list)
+                    column_type = "list" if is_list else "dict"
                 else:
                     column_type = {
                         Boolean: "bool",
                         Integer: "int",
                         Float: "float",
-                        JSON: "dict",
-                        PickleType: "dict",
                     }.get(type(col.type), "str")
-                    if col.key not in property_types:
-                        property_types[col.key] = column_type
+                if col.key not in property_types:
+                    property_types[col.key] = column_type
             for descriptor in inspect(model).all_orm_descriptors:
                 if descriptor.extension_type is ASSOCIATION_PROXY:
                     property = (
@@ -159,6 +544,8 @@ class Database:
                 }
 
     def configure_application_events(self, app):
+        self.log = app.log
+
         @event.listens_for(self.base, "after_insert", propagate=True)
         def log_instance_creation(mapper, connection, target):
             if hasattr(target, "name"):
@@ -171,19 +558,17 @@ class Database:
 
         @event.listens_for(self.base, "before_update", propagate=True)
         def log_instance_update(mapper, connection, target):
+            if getattr(target, "private", False):
+                return
+            if not getattr(target, "log_changes", True):
+                return
             state, changelog = inspect(target), []
-            for attr in state.attrs:
-                hist = state.get_history(attr.key, True)
-                if (
-                    getattr(target, "private", False)
-                    or not getattr(target, "log_changes", True)
-                    or not getattr(state.class_, attr.key).info.get("log_change", True)
-                    or attr.key in self.private_properties
-                    or not hist.has_changes()
-                ):
+            for property in self.get_tracked_properties(state.class_):
+                hist = state.get_history(property, True)
+                if not hist.has_changes():
                     continue
-                change = f"{attr.key}: "
-                property_type = type(getattr(target, attr.key))
+                change = f"{property}: "
+                property_type = type(getattr(target, property))
                 if property_type in (InstrumentedList, MutableList):
                     if property_type == MutableList:
                         added = [x for x in hist.added[0] if x not in hist.deleted[0]]
@@ -207,18 +592,338 @@ class Database:
                 )
                 app.log("info", f"UPDATE: {target.type} '{name}': ({changes})")
 
+        @event.listens_for(models["device"].latitude, "set", propagate=True)
+        @event.listens_for(models["device"].longitude, "set", propagate=True)
+        def update_coordinate(target, value, old_value, initiator):
+            setattr(target, f"{initiator.key}_value", self.coordinate(value))
+
         if app.use_vault:
 
             @event.listens_for(models["service"].name, "set", propagate=True)
             def vault_update(target, new_value, old_value, *_):
                 path = f"secret/data/{target.type}/{old_value}/password"
-                data = app.vault_client.read(path)
-                if not data:
+                password = app.vault_read(path, "password")
+                app.evict_secrets(f"secret/data/{target.type}/{old_value}/")
+                if not password:
                     return
-                app.vault_client.write(
+                app.vault_write(
                     f"secret/data/{target.type}/{new_value}/password",
-                    data={"password": data["data"]["data"]["password"]},
+                    "password",
+                    password,
+                )
+
+    def add_private_property(self, property):
+        if property in self.private_properties:
+            return
+        self.private_properties.append(property)
+        self.serializers.clear()
+        self.tracked_properties.clear()
+        for model in set(models.values()):
+            model.configure_private_property(property)
+
+    def get_serializer(self, model, export=False, exclude=None, include=None):
+        key = (model, export, exclude and tuple(exclude), include and tuple(include))
+        if key in self.serializers:
+            return self.serializers[key]
+        if len(self.serializers) >= self.serializer_cache_size:
+            self.serializers.clear()
+        no_migrate = set(self.dont_migrate.get(model, self.dont_migrate["service"]))
+        excluded = {
+            *self.private_properties,
+            *self.dont_serialize.get(model, []),
+            *(exclude or []),
+        }
+        if export:
+            excluded |= no_migrate | set(models[model].model_properties)
+        properties = tuple(
+            property
+            for property in model_properties[model]
+            if property not in excluded and (not include or property in include)
+        )
+        relations = tuple(
+            (property, relation)
+            for property, relation in relationships[model].items()
+            if (not include or property in include)
+            and property not in (exclude or [])
+            and not (export and property in no_migrate)
+        )
+        self.serializers[key] = (properties, relations)
+        return self.serializers[key]
+
+    def load_properties(self, query, model, properties):
+        table, columns = models[model], {"id", "type", *properties}
+        return query.options(
+            load_only(
+                *(
+                    column
+                    for column in columns
+                    if isinstance(
+                        getattr(getattr(table, column, None), "property", None),
+                        ColumnProperty,
+                    )
+                )
+            )
+        )
+
+    def get_loader_options(self, model, properties=(), relations=(), names_only=False):
+        key = (model, tuple(properties), tuple(relations), names_only)
+        if key in self.loader_options:
+            return self.loader_options[key]
+        mapper = inspect(models[model])
+        proxies = {
+            descriptor.info.get("name")
+            or f"{descriptor.target_collection}_{descriptor.value_attr}": (
+                descriptor.target_collection
+            )
+            for descriptor in mapper.all_orm_descriptors
+            if descriptor.extension_type is ASSOCIATION_PROXY
+        }
+        targets = {proxies[property] for property in properties if property in proxies}
+        options = []
+        for submapper in mapper.self_and_descendants:
+            for relation in targets | set(relations):
+                relationship = submapper.relationships.get(relation)
+                if not relationship or relationship.parent is not submapper:
+                    continue
+                attribute = getattr(submapper.class_, relation)
+                if not relationship.uselist:
+                    options.append(joinedload(attribute))
+                    continue
+                option = selectinload(attribute)
+                subclasses = self.get_subclasses(relationship.mapper)
+                if relation in relations and not names_only and subclasses:
+                    option = option.selectin_polymorphic(subclasses)
+                options.append(option)
+        subclasses = self.get_subclasses(mapper)
+        if subclasses:
+            options.append(selectin_polymorphic(models[model], subclasses))
+        if len(self.loader_options) >= self.serializer_cache_size:
+            self.loader_options.clear()
+        self.loader_options[key] = options
+        return options
+
+    @staticmethod
+    def get_subclasses(mapper):
+        return [
+            submapper.class_
+            for submapper in mapper.self_and_descendants
+            if submapper is not mapper
+        ]
+
+    def get_tracked_properties(self, model):
+        if model not in self.tracked_properties:
+            self.tracked_properties[model] = [
+                attr.key
+                for attr in inspect(model).attrs
+                if getattr(model, attr.key).info.get("log_change", True)
+                and attr.key not in self.private_properties
+            ]
+        return self.tracked_properties[model]
+
+    def convert_pickled_columns(self):
+        inspector = inspect(self.engine)
+        for table in self.base.metadata.sorted_tables:
+            column_types = {
+                column["name"]: column["type"]
+                for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if not isinstance(column.type, JSON):
+                    continue
+                if isinstance(column_types.get(column.name), _Binary):
+                    self.convert_pickled_column(table, column)
+
+    def convert_datetime_columns(self):
+        inspector = inspect(self.engine)
+        quote = self.engine.dialect.identifier_preparer.quote
+        for table in self.base.metadata.sorted_tables:
+            column_types = {
+                column["name"]: column["type"]
+                for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if not isinstance(column.type, self.DateTime):
+                    continue
+                if not isinstance(column_types.get(column.name), String):
+                    continue
+                table_name, name = quote(table.name), quote(column.name)
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        text(f"UPDATE {table_name} SET {name} = NULL WHERE {name} = ''")
+                    )
+                    if self.dialect == "sqlite":
+                        continue
+                    info(f"Converting column {table.name}.{column.name} to DateTime")
+                    if self.dialect == "mysql":
+                        alter = f"MODIFY {name} DATETIME(6)"
+                    else:
+                        alter = f"ALTER COLUMN {name} TYPE TIMESTAMP"
+                        alter += f" USING {name}::timestamp"
+                    connection.execute(text(f"ALTER TABLE {table_name} {alter}"))
+
+    def create_missing_columns(self):
+        inspector = inspect(self.engine)
+        quote = self.engine.dialect.identifier_preparer.quote
+        for table in self.base.metadata.sorted_tables:
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                info(f"Creating column {column.name} on table {table.name}")
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {quote(table.name)} ADD COLUMN "
+                            f"{quote(column.name)} {column_type}"
+                        )
+                    )
+
+    def update_coordinate_columns(self):
+        device = models["device"]
+        query = self.session.query(device.id, device.latitude, device.longitude).filter(
+            or_(device.latitude_value.is_(None), device.longitude_value.is_(None))
+        )
+        mappings = [
+            {
+                "id": id,
+                "latitude_value": self.coordinate(latitude),
+                "longitude_value": self.coordinate(longitude),
+            }
+            for id, latitude, longitude in query.all()
+        ]
+        for chunk in self.chunks(mappings):
+            self.session.bulk_update_mappings(device, chunk)
+        self.session.commit()
+
+    def create_missing_indexes(self):
+        inspector = inspect(self.engine)
+        for table in self.base.metadata.sorted_tables:
+            existing_indexes = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                info(f"Creating index {index.name} on table {table.name}")
+                index.create(bind=self.engine)
+
+    def create_search_index(self, properties):
+        if not settings["database"]["search_index"] or not properties:
+            return
+        try:
+            if self.dialect == "sqlite":
+                self.create_sqlite_search_index(properties)
+            elif self.dialect == "postgresql":
+                self.create_postgresql_search_index(properties)
+        except Exception as exc:
+            error(
+                f"Search index could not be created ({exc}), "
+                "device search falls back to a non-indexed scan"
+            )
+
+    def create_sqlite_search_index(self, properties):
+        if sqlite_version_info < (3, 34):
+            return warning(
+                f"SQLite {sqlite_version} has no trigram tokenizer, "
+                "device search falls back to a non-indexed scan"
+            )
+        columns = ", ".join(properties)
+        old_values = ", ".join(f"old.{property}" for property in properties)
+        new_values = ", ".join(f"new.{property}" for property in properties)
+        definition = (
+            f"CREATE VIRTUAL TABLE device_search USING fts5({columns}, "
+            "content='device', content_rowid='id', tokenize='trigram')"
+        )
+        delete = (
+            f"INSERT INTO device_search(device_search, rowid, {columns}) "
+            f"VALUES ('delete', old.id, {old_values});"
+        )
+        insert = (
+            f"INSERT INTO device_search(rowid, {columns}) "
+            f"VALUES (new.id, {new_values});"
+        )
+        triggers = {
+            "insert": f"AFTER INSERT ON device BEGIN {insert} END",
+            "delete": f"AFTER DELETE ON device BEGIN {delete} END",
+            "update": f"AFTER UPDATE OF {columns} ON device "
+            f"BEGIN {delete} {insert} END",
+        }
+        with self.engine.begin() as connection:
+            current_definition = connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE name = 'device_search'")
+            ).scalar()
+            if current_definition != definition:
+                info("Creating device search index")
+                for trigger in triggers:
+                    connection.execute(
+                        text(f"DROP TRIGGER IF EXISTS device_search_{trigger}")
+                    )
+                connection.execute(text("DROP TABLE IF EXISTS device_search"))
+                connection.execute(text(definition))
+                for trigger, body in triggers.items():
+                    connection.execute(
+                        text(f"CREATE TRIGGER device_search_{trigger} {body}")
+                    )
+                connection.execute(
+                    text("INSERT INTO device_search(device_search) VALUES ('rebuild')")
+                )
+        self.search_index_properties = set(properties)
+
+    def create_postgresql_search_index(self, properties):
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for property in properties:
+                connection.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS ix_device_{property}_trigram "
+                        f"ON device USING gin ({property} gin_trgm_ops)"
+                    )
+                )
+
+    def search_constraint(self, property, value):
+        query = (
+            select([literal_column("rowid")])
+            .select_from(text("device_search"))
+            .where(
+                literal_column(f"device_search.{property}").contains(
+                    value, autoescape=True
                 )
+            )
+        )
+        return models["device"].id.in_(query)
+
+    def convert_pickled_column(self, table, column):
+        info(f"Converting pickled column {table.name}.{column.name} to JSON")
+        quote = self.engine.dialect.identifier_preparer.quote
+        table_name, name = quote(table.name), quote(column.name)
+        json_name = quote(f"{column.name}_json")
+        json_type = column.type.compile(dialect=self.engine.dialect)
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(f"ALTER TABLE {table_name} ADD COLUMN {json_name} {json_type}")
+            )
+            rows = connection.execute(text(f"SELECT id, {name} FROM {table_name}"))
+            values = [
+                {"id": id, "value": dumps(unpickle(value), default=str)}
+                for id, value in rows
+                if value is not None
+            ]
+            for chunk in self.chunks(values):
+                connection.execute(
+                    text(
+                        f"UPDATE {table_name} SET {json_name} = :value WHERE id = :id"
+                    ),
+                    chunk,
+                )
+            connection.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {name}"))
+            if self.dialect == "mysql":
+                rename = f"CHANGE {json_name} {name} {json_type}"
+            else:
+                rename = f"RENAME COLUMN {json_name} TO {name}"
+            connection.execute(text(f"ALTER TABLE {table_name} {rename}"))
 
     def configure_associations(self):
         for model1, model2 in self.many_to_many_relationships:
@@ -249,6 +954,16 @@ class Database:
         username=None,
         **kwargs,
     ):
+        cache_key = None
+        if not all_matches and len(kwargs) == 1:
+            ((property, value),) = kwargs.items()
+            if property in self.fetch_cache_properties and not self.get_rbac_user(
+                model, rbac, username
+            ):
+                cache_key = (model, property, value)
+                instance = self.fetch_from_cache(model, cache_key)
+                if instance:
+                    return instance
         query = self.query(model, rbac, username=username).filter_by(**kwargs)
         for index in range(self.retry_fetch_number):
             try:
@@ -260,6 +975,8 @@ class Database:
                 if index == self.retry_fetch_number - 1:
                     raise exc
                 sleep(self.retry_fetch_time * (index + 1))
+        if cache_key and result:
+            self.add_to_cache(cache_key, result.id)
         if result or allow_none:
             return result
         else:
@@ -268,22 +985,42 @@ class Database:
                 f"with the following characteristics: {kwargs}"
             )
 
+    def get_rbac_user(self, model, rbac, username=None):
+        if not rbac or model == "user":
+            return
+        if current_user:
+            user = current_user
+        else:
+            user = self.fetch("user", name=username or "admin")
+        if user.is_authenticated and not user.is_admin:
+            return user
+
     def query(self, model, rbac="read", username=None):
         query = self.session.query(models[model])
-        if rbac and model != "user":
-            if current_user:
-                user = current_user
-            else:
-                user = self.fetch("user", name=username or "admin")
-            if user.is_authenticated and not user.is_admin:
-                query = models[model].rbac_filter(query, rbac, user)
+        user = self.get_rbac_user(model, rbac, username)
+        if user:
+            query = models[model].rbac_filter(query, rbac, user)
         return query
 
     def fetch_all(self, model, **kwargs):
         return self.fetch(model, allow_none=True, all_matches=True, **kwargs)
 
-    def objectify(self, model, object_list):
-        return [self.fetch(model, id=object_id) for object_id in object_list]
+    def objectify(self, model, object_list, key="id", allow_none=False):
+        table, instances = models[model], {}
+        for chunk in self.chunks(set(object_list)):
+            query = self.query(model).filter(getattr(table, key).in_(chunk))
+            instances.update((str(getattr(obj, key)), obj) for obj in query.all())
+        objects = []
+        for value in object_list:
+            instance = instances.get(str(value))
+            if not instance and not allow_none:
+                raise db.rbac_error(
+                    f"There is no {model} in the database "
+                    f"with the following characteristics: {{'{key}': {value!r}}}"
+                )
+            elif instance:
+                objects.append(instance)
+        return objects
 
     def delete(self, model, allow_none=False, **kwargs):
         instance = self.session.query(models[model]).filter_by(**kwargs).first()
@@ -307,7 +1044,18 @@ class Database:
             self.session.commit()
 
     def export(self, model):
-        return [instance.to_dict(export=True) for instance in self.fetch_all(model)]
+        relations = {
+            relation
+            for submapper in inspect(models[model]).self_and_descendants
+            for relation, _ in self.get_serializer(
+                submapper.polymorphic_identity or model, True
+            )[1]
+        }
+        options = self.get_loader_options(
+            model, relations=sorted(relations), names_only=True
+        )
+        query = self.query(model).options(*options)
+        return [instance.to_dict(export=True) for instance in query.all()]
 
     def factory(self, _class, commit=False, **kwargs):
         def transaction(_class, **kwargs):
@@ -344,6 +1092,362 @@ class Database:
                     sleep(self.retry_commit_time * (index + 1))
         return instance
 
+    def chunks(self, values):
+        values = list(values)
+        for index in range(0, len(values), self.bulk_chunk_size):
+            yield values[index : index + self.bulk_chunk_size]
+
+    def fetch_ids(self, model, values, key="name", rbac="read"):
+        table, ids = models[model], {}
+        for chunk in self.chunks(set(values)):
+            query = self.query(model, rbac).filter(getattr(table, key).in_(chunk))
+            ids.update(query.with_entities(getattr(table, key), table.id).all())
+        return ids
+
+    def resolve_relations(self, model, rows, key, result, ids=None):
+        valid_rows, names = [], defaultdict(set)
+        for row in rows:
+            if key not in row:
+                result["failure"].append((row, f"{key.capitalize()} is missing"))
+                continue
+            characters = set(str(row.get("name", "")) + row.get("scoped_name", ""))
+            if set("/\\'" + '"') & characters:
+                result["failure"].append(
+                    (row, "Names cannot contain a slash or a quote.")
+                )
+                continue
+            values = dict(row)
+            for property, relation in relationships[model].items():
+                if not relation["list"] and f"{property}_name" in values:
+                    values[property] = values.pop(f"{property}_name")
+                if property not in values or not values[property]:
+                    continue
+                value = values[property]
+                names[relation["model"]].update(value if relation["list"] else [value])
+            valid_rows.append((row, values))
+        ids = {
+            related: (ids or {}).get(related) or self.fetch_ids(related, names[related])
+            for related in names
+        }
+        resolved_rows = []
+        for row, values in valid_rows:
+            try:
+                resolved_rows.append((row, self.convert_relations(model, values, ids)))
+            except self.rbac_error as exc:
+                result["failure"].append((row, str(exc)))
+        return resolved_rows
+
+    def convert_relations(self, model, values, ids):
+        for property, relation in relationships[model].items():
+            if property not in values:
+                continue
+            value, related_ids = values[property], ids.get(relation["model"], {})
+            names = value if relation["list"] else [value] if value else []
+            missing = [name for name in names if name not in related_ids]
+            if missing:
+                raise self.rbac_error(
+                    f"There is no {relation['model']} in the database "
+                    f"with the following characteristics: {dict(name=missing[0])}"
+                )
+            converted = [related_ids[name] for name in names]
+            if relation["list"]:
+                values[property] = converted
+            else:
+                values[property] = converted[0] if converted else None
+        return values
+
+    def row_factory(self, model, row, values, key, result):
+        try:
+            self.factory(model, **values)
+            self.session.commit()
+            result["success"].append(row[key])
+        except Exception:
+            self.session.rollback()
+            result["failure"].append((row, format_exc()))
+
+    def allocate_ids(self, model, count):
+        if not count:
+            return []
+        table = inspect(models[model]).base_mapper.local_table
+        sequence = func.pg_get_serial_sequence(table.name, "id")
+        query = select([func.nextval(sequence)]).select_from(
+            func.generate_series(1, count)
+        )
+        return [id for id, in self.session.execute(query)]
+
+    def supports_bulk_import(self, table):
+        for cls in table.__mro__:
+            if "bulk_import" in vars(cls):
+                return cls.bulk_import
+            if "update" in vars(cls):
+                return False
+        return False
+
+    def split_self_references(self, model, rows):
+        table, rows = models[model], list(rows)
+        self_relations = {
+            property: relation
+            for property, relation in relationships[model].items()
+            if issubclass(table, models[relation["model"]])
+        }
+        if not self_relations:
+            return rows, []
+        names = {row["name"] for row in rows if "name" in row}
+        new_names = names - set(self.fetch_ids(model, names, rbac=None))
+        immediate_rows, deferred_rows = [], []
+        for row in rows:
+            references = set()
+            for property, relation in self_relations.items():
+                value = row.get(property) or row.get(f"{property}_name")
+                if value:
+                    references.update(value if relation["list"] else [value])
+            if references & new_names:
+                deferred_rows.append(row)
+            else:
+                immediate_rows.append(row)
+        return immediate_rows, deferred_rows
+
+    def update_pools_membership(self, object_type, object_ids):
+        pool, pool_ids = models["pool"], self.get_pool_index(object_type)["pools"]
+        if not object_ids or not pool_ids:
+            return
+        for instance in self.session.query(pool).filter(pool.id.in_(pool_ids)):
+            instance.compute_membership(object_type, object_ids)
+        self.session.commit()
+
+    def bulk_factory(self, model, rows, key="name", ids=None):
+        table, result = models[model], defaultdict(list)
+        rows, deferred_rows = self.split_self_references(model, rows)
+        resolved_rows = self.resolve_relations(model, rows, key, result, ids)
+        if self.supports_bulk_import(table):
+            self.bulk_insert_rows(model, resolved_rows, key, result)
+        else:
+            for row, values in resolved_rows:
+                self.row_factory(model, row, values, key, result)
+        related_ids = {
+            related: value for related, value in (ids or {}).items() if related != model
+        }
+        for deferred_row in deferred_rows:
+            for row, values in self.resolve_relations(
+                model, [deferred_row], key, result, related_ids
+            ):
+                self.row_factory(model, row, values, key, result)
+        return result
+
+    def bulk_insert_rows(self, model, rows, key, result):
+        table = models[model]
+        mapper = inspect(table)
+        columns = {attribute.key for attribute in mapper.column_attrs}
+        relations = {
+            property: mapper.relationships[property]
+            for property in relationships[model]
+        }
+        for chunk in self.chunks(rows):
+            keys = [values[key] for _, values in chunk]
+            existing_ids = self.fetch_ids(model, keys, key, rbac=None)
+            editable_ids = self.fetch_ids(model, existing_ids, key, rbac="edit")
+            inserts, updates, associations = [], [], []
+            for row, values in chunk:
+                mapping = {
+                    property: value
+                    for property, value in table.bulk_properties(**values).items()
+                    if property in columns and property != "id"
+                }
+                for property, relation in relations.items():
+                    if property not in values or relation.uselist:
+                        continue
+                    mapping[relation.local_remote_pairs[0][0].key] = values[property]
+                if values[key] in existing_ids:
+                    if values[key] not in editable_ids:
+                        result["failure"].append(
+                            (row, "Error 403 - Operation not allowed.")
+                        )
+                        continue
+                    mapping["id"] = existing_ids[values[key]]
+                    updates.append(mapping)
+                else:
+                    if mapper.polymorphic_on is not None:
+                        mapping["type"] = mapper.polymorphic_identity
+                    inserts.append(mapping)
+                associations.append((row, values, mapping))
+            return_defaults = self.dialect != "postgresql" and (
+                mapper.inherits
+                or any(
+                    relations[property].uselist
+                    for _, values, _ in associations
+                    for property in values
+                    if property in relations
+                )
+            )
+            previous_values = self.get_previous_values(model, associations)
+            try:
+                if self.dialect == "postgresql":
+                    allocated_ids = self.allocate_ids(model, len(inserts))
+                    for mapping, id in zip(inserts, allocated_ids):
+                        mapping["id"] = id
+                self.session.bulk_insert_mappings(
+                    table, inserts, return_defaults=bool(return_defaults)
+                )
+                self.session.bulk_update_mappings(table, updates)
+                self.bulk_associations(relations, associations)
+                self.session.commit()
+            except Exception as exc:
+                error(f"Bulk {model} import failed ({exc}), importing row by row")
+                self.session.rollback()
+                for row, values, _ in associations:
+                    self.row_factory(model, row, values, key, result)
+                continue
+            result["success"].extend(row[key] for row, *_ in associations)
+            self.log_bulk_changes(model, key, associations, previous_values)
+            if hasattr(table, "update_pool_membership"):
+                names = [
+                    values[key]
+                    for _, values, _ in associations
+                    if not values.get("dont_update_pools")
+                ]
+                object_ids = list(self.fetch_ids(model, names, key, rbac=None).values())
+                self.update_pools_membership(table.class_type, object_ids)
+
+    @staticmethod
+    def loggable_value(value, uselist=False):
+        if uselist:
+            return [str(getattr(item, "name", item)) for item in value]
+        return None if value is None else str(getattr(value, "name", value))
+
+    def get_previous_values(self, model, associations):
+        table, relations = models[model], relationships[model]
+        tracked_properties = self.get_tracked_properties(table)
+        ids = [mapping["id"] for *_, mapping in associations if "id" in mapping]
+        properties = {
+            property
+            for _, values, mapping in associations
+            if "id" in mapping
+            for property in values
+            if property in tracked_properties
+        }
+        if not ids or not properties:
+            return {}
+        query = self.session.query(table).filter(table.id.in_(ids))
+        for property in properties & set(relations):
+            query = query.options(selectinload(getattr(table, property)))
+        return {
+            instance.id: {
+                property: self.loggable_value(
+                    getattr(instance, property),
+                    relations.get(property, {}).get("list"),
+                )
+                for property in properties
+            }
+            for instance in query
+        }
+
+    def log_bulk_changes(self, model, key, associations, previous_values):
+        relations = relationships[model]
+        for row, values, mapping in associations:
+            name = values[key]
+            if mapping.get("id") not in previous_values:
+                self.log("info", f"CREATION: {model} '{name}'")
+                continue
+            changes = []
+            for property, old_value in previous_values[mapping["id"]].items():
+                if property not in values or property == key:
+                    continue
+                relation = relations.get(property)
+                if relation:
+                    new_value = row.get(property, row.get(f"{property}_name"))
+                else:
+                    new_value = mapping.get(property, values[property])
+                if relation and relation["list"]:
+                    new_value = self.loggable_value(new_value, True)
+                    deleted = [item for item in old_value if item not in new_value]
+                    added = [item for item in new_value if item not in old_value]
+                    change = f"{property}: "
+                    if deleted:
+                        change += f"DELETED: {deleted}"
+                    if added:
+                        change += f"{' / ' if deleted else ''}ADDED: {added}"
+                    if deleted or added:
+                        changes.append(change)
+                elif self.loggable_value(new_value) != old_value:
+                    changes.append(f"{property}: '{old_value}' => '{new_value}'")
+            if changes:
+                self.log("info", f"UPDATE: {model} '{name}': ({' | '.join(changes)})")
+
+    def bulk_writer(self, model, queue):
+        done = False
+        try:
+            while not done:
+                mappings = [queue.get()]
+                while not queue.empty() and len(mappings) < self.bulk_chunk_size:
+                    mappings.append(queue.get())
+                if mappings[-1] is None:
+                    done = True
+                    mappings.pop()
+                if mappings:
+                    self.write_mappings(model, mappings)
+                for _ in range(len(mappings) + done):
+                    queue.task_done()
+        finally:
+            self.session.remove()
+
+    def insert_mappings(self, model, mappings):
+        try:
+            self.session.bulk_insert_mappings(models[model], mappings)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            error(f"Bulk {model} write failed:\n{format_exc()}")
+
+    def write_mappings(self, model, mappings):
+        if not self.write_serializer:
+            return self.insert_mappings(model, mappings)
+        with self.write_thread_lock:
+            if not self.write_thread or not self.write_thread.is_alive():
+                self.write_thread = Thread(target=self.serialize_writes, daemon=True)
+                self.write_thread.start()
+        written = Event()
+        self.write_queue.put((model, mappings, written))
+        written.wait()
+
+    def serialize_writes(self):
+        while True:
+            writes = [self.write_queue.get()]
+            while not self.write_queue.empty() and len(writes) < self.bulk_chunk_size:
+                writes.append(self.write_queue.get())
+            try:
+                for model, mappings, _ in writes:
+                    self.session.bulk_insert_mappings(models[model], mappings)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                for model, mappings, _ in writes:
+                    self.insert_mappings(model, mappings)
+            for *_, written in writes:
+                written.set()
+
+    def bulk_associations(self, relations, associations):
+        for property, relation in relations.items():
+            if not relation.uselist or relation.secondary is None:
+                continue
+            local = relation.synchronize_pairs[0][1]
+            remote = relation.secondary_synchronize_pairs[0][1]
+            rows = [
+                (mapping["id"], values[property])
+                for _, values, mapping in associations
+                if property in values
+            ]
+            if not rows:
+                continue
+            for chunk in self.chunks(row_id for row_id, _ in rows):
+                self.session.execute(relation.secondary.delete(local.in_(chunk)))
+            pairs = [
+                {local.key: row_id, remote.key: related_id}
+                for row_id, related_ids in rows
+                for related_id in related_ids
+            ]
+            if pairs:
+                self.session.execute(relation.secondary.insert(), pairs)
+
     @contextmanager
     def session_scope(self):
         try:
@@ -382,7 +1486,10 @@ class Database:
                 self.dont_serialize[model].append(property)
             if not values.get("migrate", True):
                 self.dont_migrate[model].append(property)
+            if values.get("configuration"):
+                column = deferred(column)
             setattr(table, property, column)
+        self.tracked_properties.clear()
         return table
 
 
@@ -76,11 +76,8 @@ class MetaForm(FormMeta):
             }
             if field.args and isinstance(field.args[0], str):
                 app.property_names[field_name] = field.args[0]
-            if (
-                issubclass(field.field_class, PasswordField)
-                and field_name not in db.private_properties
-            ):
-                db.private_properties.append(field_name)
+            if issubclass(field.field_class, PasswordField):
+                db.add_private_property(field_name)
         form_properties[form_type].update(properties)
         for property, value in properties.items():
             if property not in property_types and value["type"] != "field-list":
@@ -45,9 +45,14 @@ class ResultLogDeletionForm(BaseForm):
     form_type = HiddenField(default="result_log_deletion")
     deletion_types = SelectMultipleField(
         "Instances do delete",
-        choices=[("run", "result"), ("changelog", "changelog")],
+        choices=[
+            ("run", "result"),
+            ("changelog", "changelog"),
+            ("run_archive", "archived results"),
+        ],
     )
     date_time = StringField(type="date", label="Delete Records before")
+    archive = BooleanField("Archive results before deletion")
 
 
 class ServerForm(BaseForm):
@@ -4,6 +4,7 @@ from itertools import chain
 from passlib.hash import argon2
 from sqlalchemy import Boolean, Integer
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
 
 from eNMS import app
 from eNMS.database import db
@@ -49,6 +50,7 @@ class User(AbstractBase, UserMixin):
         "Access", secondary=db.access_user_table, back_populates="users"
     )
     is_admin = db.Column(Boolean, default=False)
+    rbac_ids = db.Column(db.Dict, info={"log_change": False, "model_properties": False})
 
     def add_access(self, model, instance):
         for group in self.groups:
@@ -58,6 +60,8 @@ class User(AbstractBase, UserMixin):
                 access.groups.append(group)
                 setattr(access, f"{model}_access", str(app.rbac["models"][model]))
             getattr(access, model).append(instance)
+            for user in group.users:
+                user.rbac_ids = {}
 
     def get_id(self):
         return self.name
@@ -82,6 +86,27 @@ class User(AbstractBase, UserMixin):
                 continue
             result = (getattr(access, access_type) for access in self.user_access)
             setattr(self, access_type, list(set().union(*result)))
+        self.rbac_ids = self.compute_rbac_ids()
+
+    def compute_rbac_ids(self):
+        rbac_ids = {}
+        for model, access_rights in app.rbac["models"].items():
+            modes = [access_right.split()[-1].lower() for access_right in access_rights]
+            ids = {mode: set() for mode in ("any", *modes)}
+            for access in self.user_access:
+                instance_ids = {instance.id for instance in getattr(access, model)}
+                ids["any"] |= instance_ids
+                rights = (getattr(access, f"{model}_access") or "").lower()
+                for mode in modes:
+                    if mode in rights:
+                        ids[mode] |= instance_ids
+            rbac_ids[model] = {mode: list(mode_ids) for mode, mode_ids in ids.items()}
+        return rbac_ids
+
+    def get_rbac_ids(self, model, mode):
+        if not self.rbac_ids:
+            set_committed_value(self, "rbac_ids", self.compute_rbac_ids())
+        return self.rbac_ids.get(model, {}).get(mode, [])
 
 
 @db.set_custom_properties
@@ -96,6 +121,10 @@ class Group(AbstractBase):
         "Access", secondary=db.access_group_table, back_populates="groups"
     )
 
+    def delete(self):
+        for user in self.users:
+            user.rbac_ids = {}
+
     def update(self, **kwargs):
         old_users = set(self.users)
         super().update(**kwargs)
@@ -134,6 +163,13 @@ class Access(AbstractBase):
         group_users = chain.from_iterable(group.users for group in self.groups)
         return set(self.users) | set(group_users)
 
+    def reset_rbac(self):
+        for user in self.get_users():
+            user.rbac_ids = {}
+
+    def delete(self):
+        self.reset_rbac()
+
     def update(self, **kwargs):
         old_users = self.get_users()
         super().update(**kwargs)
@@ -148,7 +184,7 @@ class Changelog(AbstractBase):
     type = db.Column(db.SmallString)
     __mapper_args__ = {"polymorphic_identity": "changelog", "polymorphic_on": type}
     id = db.Column(Integer, primary_key=True)
-    time = db.Column(db.TinyString)
+    time = db.Column(db.DateTime, index=True)
     content = db.Column(db.LargeString)
     severity = db.Column(db.TinyString, default="debug")
     user = db.Column(db.SmallString, default="admin")
@@ -5,20 +5,21 @@ from flask_login import current_user
 from functools import partial
 from importlib import __import__ as importlib_import
 from io import BytesIO
-from json import loads
+from json import dumps, loads
 from json.decoder import JSONDecodeError
 from multiprocessing.pool import ThreadPool
 from napalm import get_network_driver
 from netmiko import ConnectHandler
 from os import environ
 from paramiko import SFTPClient
+from queue import Queue
 from ruamel import yaml
 from re import compile, search
 from requests import post
 from scp import SCPClient
-from sqlalchemy import Boolean, ForeignKey, Index, Integer, or_
+from sqlalchemy import Boolean, ForeignKey, Index, Integer, or_, select
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import aliased, relationship
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import true
 from threading import Thread
 from time import sleep
@@ -26,6 +27,7 @@ from traceback import format_exc
 from warnings import warn
 from xmltodict import parse
 from xml.parsers.expat import ExpatError
+from zlib import compress, compressobj, decompress
 
 try:
     from scrapli import Scrapli
@@ -152,6 +154,10 @@ class Service(AbstractBase):
         else:
             return {self, workflow}
 
+    def delete(self):
+        for access in self.access:
+            access.reset_rbac()
+
     def update(self, **kwargs):
         if "scoped_name" in kwargs and kwargs.get("scoped_name") != self.scoped_name:
             self.set_name(kwargs["scoped_name"])
@@ -196,25 +202,19 @@ class Service(AbstractBase):
         return app.strip_all(self.name)
 
     @classmethod
-    def rbac_filter(cls, query, mode, user):
-        service_alias = aliased(models["service"])
-        public_services = query.filter(models["service"].public == true())
-        user_services = (
-            query.join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["user"], models["access"].users)
-            .filter(models["access"].services_access.contains(mode))
-            .filter(models["user"].name == user.name)
+    def rbac_criterion(cls, mode, user):
+        originals = db.originals_association.c
+        accessible_services = select([originals.original_id]).where(
+            originals.child_id.in_(user.get_rbac_ids("services", mode))
         )
-        user_group_services = (
-            query.join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["group"], models["access"].groups)
-            .join(models["user"], models["group"].users)
-            .filter(models["access"].services_access.contains(mode))
-            .filter(models["user"].name == user.name)
+        return or_(
+            models["service"].public == true(),
+            models["service"].id.in_(accessible_services),
         )
-        return public_services.union(user_services, user_group_services)
+
+    @classmethod
+    def rbac_filter(cls, query, mode, user):
+        return query.filter(cls.rbac_criterion(mode, user))
 
     def set_name(self, name=None):
         if self.shared:
@@ -248,16 +248,22 @@ class ConnectionService(Service):
 class Result(AbstractBase):
 
     __tablename__ = type = "result"
+    __table_args__ = (
+        Index(
+            "ix_result_parent_runtime_0", "parent_runtime", "service_id", "device_id"
+        ),
+        Index("ix_result_run_id_0", "run_id", "device_id"),
+    )
     private = True
     log_change = False
     id = db.Column(Integer, primary_key=True)
     success = db.Column(Boolean, default=False)
-    runtime = db.Column(db.TinyString)
+    runtime = db.Column(db.DateTime, index=True)
     duration = db.Column(db.TinyString)
     result = db.Column(db.Dict)
     run_id = db.Column(Integer, ForeignKey("run.id", ondelete="cascade"))
     run = relationship("Run", back_populates="results", foreign_keys="Result.run_id")
-    parent_runtime = db.Column(db.TinyString)
+    parent_runtime = db.Column(db.DateTime, index=True)
     parent_device_id = db.Column(Integer, ForeignKey("device.id"))
     parent_device = relationship("Device", uselist=False, foreign_keys=parent_device_id)
     parent_device_name = association_proxy("parent_device", "name")
@@ -294,11 +300,10 @@ class Result(AbstractBase):
         if kwargs.get("rest_api_request", False):
             return []
         if not kwargs.get("full_result"):
+            instance_type = kwargs["instance"]["type"]
+            property = "device_id" if instance_type == "device" else "service_id"
             constraints.append(
-                getattr(
-                    models["result"],
-                    "device" if kwargs["instance"]["type"] == "device" else "service",
-                ).has(id=kwargs["instance"]["id"])
+                getattr(models["result"], property) == kwargs["instance"]["id"]
             )
         if kwargs.get("runtime"):
             constraints.append(models["result"].parent_runtime == kwargs["runtime"])
@@ -320,6 +325,60 @@ class ServiceLog(AbstractBase):
         return f"SERVICE '{self.service}' ({self.runtime})"
 
 
+class RunArchive(AbstractBase):
+
+    __tablename__ = type = "run_archive"
+    private = True
+    log_change = False
+    id = db.Column(Integer, primary_key=True)
+    partition = db.Column(db.TinyString, index=True)
+    runtime = db.Column(db.DateTime, index=True)
+    service = db.Column(db.SmallString)
+    first_run_id = db.Column(Integer, index=True)
+    last_run_id = db.Column(Integer)
+    first_result_id = db.Column(Integer, index=True)
+    last_result_id = db.Column(Integer)
+    content = db.Column(db.LargeBinary)
+
+    def __repr__(self):
+        return f"ARCHIVE '{self.service}' ({self.runtime})"
+
+    @property
+    def data(self):
+        return loads(decompress(self.content))
+
+    def update(self, data=None, **kwargs):
+        super().update(**kwargs)
+        if data is None:
+            return
+        self.content = compress(dumps(data, default=str).encode("utf-8"))
+        for model in ("run", "result"):
+            ids = [instance["id"] for instance in data[f"{model}s"]]
+            setattr(self, f"first_{model}_id", min(ids, default=None))
+            setattr(self, f"last_{model}_id", max(ids, default=None))
+
+    def write_content(self, sections):
+        compressor, content = compressobj(), []
+        for index, (model, rows) in enumerate(sections):
+            header = f'{", " if index else "{"}"{model}s": ['
+            content.append(compressor.compress(header.encode("utf-8")))
+            first_id = last_id = None
+            for row_index, row in enumerate(rows):
+                row = dict(row)
+                if first_id is None or row["id"] < first_id:
+                    first_id = row["id"]
+                if last_id is None or row["id"] > last_id:
+                    last_id = row["id"]
+                value = f'{", " if row_index else ""}{dumps(row, default=str)}'
+                content.append(compressor.compress(value.encode("utf-8")))
+            content.append(compressor.compress(b"]"))
+            if model in ("run", "result"):
+                setattr(self, f"first_{model}_id", first_id)
+                setattr(self, f"last_{model}_id", last_id)
+        content.append(compressor.compress(b"}") + compressor.flush())
+        self.content = b"".join(content)
+
+
 class Run(AbstractBase):
 
     __tablename__ = type = "run"
@@ -328,6 +387,7 @@ class Run(AbstractBase):
         Index(
             "ix_run_start_service_id_0", "start_service_id", "parent_runtime", "runtime"
         ),
+        Index("ix_run_parent_runtime_1", "parent_runtime", "service_id"),
     )
     private = True
     id = db.Column(Integer, primary_key=True)
@@ -338,7 +398,7 @@ class Run(AbstractBase):
     properties = db.Column(db.Dict)
     success = db.Column(Boolean, default=False)
     status = db.Column(db.TinyString, default="Running")
-    runtime = db.Column(db.TinyString, index=True)
+    runtime = db.Column(db.DateTime, index=True)
     duration = db.Column(db.TinyString)
     trigger = db.Column(db.TinyString, default="UI")
     parent_id = db.Column(Integer, ForeignKey("run.id", ondelete="cascade"))
@@ -346,7 +406,7 @@ class Run(AbstractBase):
         "Run", remote_side=[id], foreign_keys="Run.parent_id", back_populates="children"
     )
     children = relationship("Run", foreign_keys="Run.parent_id")
-    parent_runtime = db.Column(db.TinyString)
+    parent_runtime = db.Column(db.DateTime, index=True)
     path = db.Column(db.TinyString)
     parent_device_id = db.Column(Integer, ForeignKey("device.id"))
     parent_device = relationship("Device", foreign_keys="Run.parent_device_id")
@@ -398,26 +458,8 @@ class Run(AbstractBase):
 
     @classmethod
     def rbac_filter(cls, query, mode, user):
-        public_services = query.join(cls.service).filter(
-            models["service"].public == true()
-        )
-        service_alias = aliased(models["service"])
-        user_services = (
-            query.join(cls.service)
-            .join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["user"], models["access"].users)
-            .filter(models["user"].name == user.name)
-        )
-        user_group_services = (
-            query.join(cls.service)
-            .join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["group"], models["access"].groups)
-            .join(models["user"], models["group"].users)
-            .filter(models["user"].name == user.name)
-        )
-        return public_services.union(user_services, user_group_services)
+        criterion = models["service"].rbac_criterion("any", user)
+        return query.join(cls.service).filter(criterion)
 
     @property
     def name(self):
@@ -445,8 +487,13 @@ class Run(AbstractBase):
             raise AttributeError
 
     def result(self, device=None):
-        result = [r for r in self.results if r.device_name == device]
-        return result.pop() if result else None
+        result = models["result"]
+        query = db.session.query(result).filter(result.run_id == self.id)
+        if device:
+            query = query.join(result.device).filter(models["device"].name == device)
+        else:
+            query = query.filter(result.device_id.is_(None))
+        return query.order_by(result.id.desc()).first()
 
     @property
     def service_properties(self):
@@ -593,6 +640,9 @@ class Run(AbstractBase):
                 "service": self.service.get_properties(exclude=["positions"]),
             }
             results["trigger"] = self.trigger
+            if self.runtime == self.parent_runtime:
+                if db.query_monitoring["attach_to_results"]:
+                    results["queries"] = db.query_summary()
             if (
                 self.runtime == self.parent_runtime
                 or len(self.devices) > 1
@@ -619,10 +669,17 @@ class Run(AbstractBase):
 
     @staticmethod
     def get_device_result(args):
-        device_id, runtime, payload, results = args
-        device = db.fetch("device", id=device_id)
-        run = db.fetch("run", runtime=runtime)
-        results.append(run.get_results(payload, device))
+        device_id, run_id, payload, results, result_queue = args
+        try:
+            run = db.fetch("run", id=run_id, rbac=None)
+            with db.monitor_queries(f"run/{run.parent_runtime}"):
+                device = db.fetch("device", id=device_id, rbac=None)
+                results.append(
+                    run.get_results(payload, device, result_queue=result_queue)
+                )
+            db.session.commit()
+        finally:
+            db.session.remove()
 
     def device_iteration(self, payload, device):
         derived_devices = self.compute_devices_from_query(
@@ -685,14 +742,20 @@ class Run(AbstractBase):
                 self.log("error", error)
                 return {"success": False, "runtime": self.runtime, "result": error}
             if self.multiprocessing and len(self.devices) > 1:
-                results = []
+                results, result_queue = [], Queue()
                 processes = min(len(self.devices), self.max_processes)
                 process_args = [
-                    (device.id, self.runtime, payload, results)
+                    (device.id, self.id, payload, results, result_queue)
                     for device in self.devices
                 ]
-                with ThreadPool(processes=processes) as pool:
-                    pool.map(self.get_device_result, process_args)
+                writer = Thread(target=db.bulk_writer, args=("result", result_queue))
+                writer.start()
+                try:
+                    with ThreadPool(processes=processes) as pool:
+                        pool.map(self.get_device_result, process_args)
+                finally:
+                    result_queue.put(None)
+                    writer.join()
             else:
                 results = [
                     self.get_results(payload, device, commit=False)
@@ -707,9 +770,27 @@ class Run(AbstractBase):
                 "runtime": self.runtime,
             }
 
-    def create_result(self, results, device=None, commit=True):
+    def create_result(self, results, device=None, commit=True, result_queue=None):
         self.success = results["success"]
         results = self.make_results_json_compliant(results)
+        if result_queue and device:
+            if self.disable_result_creation:
+                return results
+            result_queue.put(
+                {
+                    "result": results,
+                    "success": results["success"],
+                    "runtime": results["runtime"],
+                    "duration": results["duration"],
+                    "run_id": self.id,
+                    "service_id": self.service_id,
+                    "parent_runtime": self.parent_runtime,
+                    "workflow_id": self.workflow_id,
+                    "parent_device_id": self.parent_device_id,
+                    "device_id": device.id,
+                }
+            )
+            return results
         result_kw = {
             "run": self,
             "service": self.service_id,
@@ -809,7 +890,7 @@ class Run(AbstractBase):
                 results = {"success": False, "result": result}
         return results
 
-    def get_results(self, payload, device=None, commit=True):
+    def get_results(self, payload, device=None, commit=True, result_queue=None):
         self.log("info", "STARTING", device)
         start = datetime.now().replace(microsecond=0)
         skip_service = False
@@ -827,7 +908,10 @@ class Run(AbstractBase):
             if device:
                 self.write_state("progress/device/skipped", 1, "increment")
             self.create_result(
-                {"runtime": app.get_time(), **results}, device, commit=commit
+                {"runtime": app.get_time(), **results},
+                device,
+                commit=commit,
+                result_queue=result_queue,
             )
             return results
         try:
@@ -868,7 +952,10 @@ class Run(AbstractBase):
             status = "success" if results["success"] else "failure"
             self.write_state(f"progress/device/{status}", 1, "increment")
             self.create_result(
-                {"runtime": app.get_time(), **results}, device, commit=commit
+                {"runtime": app.get_time(), **results},
+                device,
+                commit=commit,
+                result_queue=result_queue,
             )
         self.log("info", "FINISHED", device)
         if self.waiting_time:
@@ -932,16 +1019,24 @@ class Run(AbstractBase):
         file_content = deepcopy(notification)
         if self.include_device_results:
             file_content["Device Results"] = {}
-            for device in self.devices:
-                device_result = db.fetch(
-                    "result",
-                    service_id=self.service_id,
-                    parent_runtime=self.parent_runtime,
-                    device_id=device.id,
-                    allow_none=True,
+            result = models["result"]
+            device_results = {
+                device_id: device_result
+                for device_id, device_result in db.session.query(
+                    result.device_id, result.result
                 )
-                if device_result:
-                    file_content["Device Results"][device.name] = device_result.result
+                .filter(
+                    result.parent_runtime == self.parent_runtime,
+                    result.service_id == self.service_id,
+                    result.device_id.isnot(None),
+                )
+                .order_by(result.id)
+            }
+            for device in self.devices:
+                if device.id in device_results:
+                    file_content["Device Results"][device.name] = device_results[
+                        device.id
+                    ]
         try:
             if self.send_notification_method == "mail":
                 filename = self.runtime.replace(".", "").replace(":", "")
@@ -1090,31 +1185,39 @@ class Run(AbstractBase):
         return self.payload_helper(*args, operation="get", **kwargs)
 
     def get_result(self, service_name, device=None, workflow=None):
-        def filter_run(query, property):
-            query = query.filter(
-                models["run"].service.has(
-                    getattr(models["service"], property) == service_name
-                )
+        result, service = models["result"], models["service"]
+        if workflow:
+            workflow_query = db.session.query(models["workflow"].id).filter(
+                models["workflow"].name == workflow
             )
-            return query.all()
+            workflow_ids = [id for (id,) in workflow_query]
+
+        def filter_result(query, property):
+            query = query.filter(getattr(service, property) == service_name)
+            return query.order_by(result.id.desc()).first()
 
         def recursive_search(run: "Run"):
             if not run:
                 return None
-            query = db.session.query(models["run"]).filter(
-                models["run"].parent_runtime == run.parent_runtime
+            query = (
+                db.session.query(result.result)
+                .join(models["run"], result.run_id == models["run"].id)
+                .join(service, models["run"].service_id == service.id)
+                .filter(models["run"].parent_runtime == run.parent_runtime)
             )
-            if workflow or self.workflow:
-                name = workflow or self.workflow.name
-                query.filter(
-                    models["run"].workflow.has(models["workflow"].name == name)
+            if workflow:
+                query = query.filter(models["run"].workflow_id.in_(workflow_ids))
+            if device:
+                query = query.join(result.device).filter(
+                    models["device"].name == device
                 )
-            runs = filter_run(query, "scoped_name") or filter_run(query, "name")
-            results = list(filter(None, [run.result(device) for run in runs]))
-            if not results:
+            else:
+                query = query.filter(result.device_id.is_(None))
+            match = filter_result(query, "scoped_name") or filter_result(query, "name")
+            if not match:
                 return recursive_search(run.restart_run)
             else:
-                return results.pop().result
+                return match.result
 
         return recursive_search(self)
 
@@ -1,8 +1,38 @@
 from sqlalchemy.ext.mutable import MutableDict, MutableList
+from sqlalchemy.orm.attributes import InstrumentedAttribute, QueryableAttribute
 
 from eNMS import app
 from eNMS.database import db
-from eNMS.models import model_properties, property_types, relationships
+from eNMS.models import models, property_types, relationships
+
+
+class PrivateProperty:
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self.key = attribute.key
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.attribute
+        elif app.use_vault:
+            target = instance.service if instance.type == "run" else instance
+            path = f"secret/data/{target.type}/{target.name}/{self.key}"
+            return app.vault_read(path, self.key)
+        else:
+            return self.attribute.__get__(instance, owner)
+
+    def __set__(self, instance, value):
+        if not value:
+            return
+        value = app.encrypt_password(value)
+        if app.use_vault:
+            app.vault_write(
+                f"secret/data/{instance.type}/{instance.name}/{self.key}",
+                self.key,
+                value.decode("utf-8"),
+            )
+        else:
+            self.attribute.__set__(instance, value)
 
 
 class AbstractBase(db.base):
@@ -19,33 +49,11 @@ class AbstractBase(db.base):
     def __repr__(self):
         return getattr(self, "name", str(self.id))
 
-    def __getattribute__(self, property):
-        if property in db.private_properties:
-            if app.use_vault:
-                target = self.service if self.type == "run" else self
-                path = f"secret/data/{target.type}/{target.name}/{property}"
-                data = app.vault_client.read(path)
-                value = data["data"]["data"][property] if data else ""
-            else:
-                value = super().__getattribute__(property)
-            return value
-        else:
-            return super().__getattribute__(property)
-
-    def __setattr__(self, property, value):
-        if property in db.private_properties:
-            if not value:
-                return
-            value = app.encrypt_password(value)
-            if app.use_vault:
-                app.vault_client.write(
-                    f"secret/data/{self.type}/{self.name}/{property}",
-                    data={property: value.decode("utf-8")},
-                )
-            else:
-                super().__setattr__(property, value)
-        else:
-            super().__setattr__(property, value)
+    @classmethod
+    def configure_private_property(cls, property):
+        attribute = cls.__dict__.get(property)
+        if isinstance(attribute, InstrumentedAttribute):
+            setattr(cls, property, PrivateProperty(attribute))
 
     @classmethod
     def filtering_constraints(cls, **_):
@@ -74,24 +82,33 @@ class AbstractBase(db.base):
                 value = value not in (False, "false")
             setattr(self, property, value)
 
+    @classmethod
+    def bulk_properties(cls, **kwargs):
+        properties = {}
+        for property, value in kwargs.items():
+            if property in db.private_properties:
+                if not value:
+                    continue
+                value = app.encrypt_password(value)
+                if app.use_vault:
+                    app.vault_write(
+                        f"secret/data/{cls.__tablename__}/{kwargs['name']}/{property}",
+                        property,
+                        value.decode("utf-8"),
+                    )
+                    continue
+            elif property_types.get(property) == "bool":
+                value = value not in (False, "false")
+            properties[property] = value
+        return properties
+
     def delete(self):
         pass
 
     def get_properties(self, export=False, exclude=None, include=None):
         result = {}
-        no_migrate = db.dont_migrate.get(self.type, db.dont_migrate["service"])
-        properties = list(model_properties[self.type])
+        properties, _ = db.get_serializer(self.type, export, exclude, include)
         for property in properties:
-            if property in db.private_properties:
-                continue
-            if property in db.dont_serialize.get(self.type, []):
-                continue
-            if export and property in getattr(self, "model_properties", []):
-                continue
-            if include and property not in include or exclude and property in exclude:
-                continue
-            if export and property in no_migrate:
-                continue
             try:
                 value = getattr(self, property)
             except AttributeError:
@@ -126,19 +143,15 @@ class AbstractBase(db.base):
         self, export=False, relation_names_only=False, exclude=None, include=None
     ):
         properties = self.get_properties(export, exclude=exclude)
-        no_migrate = db.dont_migrate.get(self.type, db.dont_migrate["service"])
-        for property, relation in relationships[self.type].items():
-            if include and property not in include or exclude and property in exclude:
-                continue
-            if export and property in no_migrate:
+        _, relations = db.get_serializer(self.type, export, exclude, include)
+        for property, relation in relations:
+            if relation["list"] and (export or relation_names_only):
+                properties[property] = self.get_relation_names(property, relation)
                 continue
             value = getattr(self, property)
             if relation["list"]:
                 properties[property] = [
-                    obj.name
-                    if export or relation_names_only
-                    else obj.get_properties(exclude=exclude)
-                    for obj in value
+                    obj.get_properties(exclude=exclude) for obj in value
                 ]
             else:
                 if not value:
@@ -150,6 +163,15 @@ class AbstractBase(db.base):
                 )
         return properties
 
+    def get_relation_names(self, property, relation):
+        related_name = getattr(models[relation["model"]], "name")
+        if property in self.__dict__ or not isinstance(
+            related_name, QueryableAttribute
+        ):
+            return [obj.name for obj in getattr(self, property)]
+        query = db.session.query(related_name).with_parent(self, property)
+        return [name for name, in query]
+
     @property
     def serialized(self):
         return self.to_dict()
@@ -1,10 +1,14 @@
 from flask_login import current_user
-from re import search, sub
-from sqlalchemy import Boolean, ForeignKey, Integer
+from hashlib import sha256
+from re import escape, search, sub
+from sqlalchemy import and_, Boolean, cast, Float, ForeignKey, func, Integer, literal
+from sqlalchemy import Index, inspect, or_, String, Text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import backref, relationship
+from sqlalchemy.orm import backref, deferred, relationship
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.sql.expression import true
+from zlib import compress, decompress
 
 from eNMS import app
 from eNMS.models import models
@@ -18,6 +22,7 @@ class Object(AbstractBase):
     __tablename__ = "object"
     type = db.Column(db.SmallString)
     __mapper_args__ = {"polymorphic_identity": "object", "polymorphic_on": type}
+    bulk_import = True
     id = db.Column(Integer, primary_key=True)
     public = db.Column(Boolean)
     last_modified = db.Column(db.TinyString, info={"log_change": False})
@@ -29,18 +34,33 @@ class Object(AbstractBase):
 
     def update(self, **kwargs):
         super().update(**kwargs)
-        if kwargs.get("dont_update_pools", False):
+        if not kwargs.get("dont_update_pools", False):
+            self.update_pool_membership(changed_only=True)
+
+    def update_pool_membership(self, changed_only=False):
+        index, state = db.get_pool_index(self.class_type), inspect(self)
+        pool_ids = set(index["pools"])
+        if changed_only and state.persistent:
+            pool_ids = set()
+            for property, property_pool_ids in index["properties"].items():
+                attribute = getattr(self.__class__, property)
+                key = getattr(attribute, "target_collection", property)
+                if state.attrs[key].history.has_changes():
+                    pool_ids |= property_pool_ids
+        if not pool_ids:
             return
-        for pool in db.fetch_all("pool"):
-            if pool.manually_defined or not pool.compute(self.class_type):
-                continue
-            match = pool.object_match(self)
-            relation, number = f"{self.class_type}s", f"{self.class_type}_number"
-            if match and self not in getattr(pool, relation):
-                getattr(pool, relation).append(self)
+        pools, number = {
+            pool.id: pool for pool in self.pools
+        }, f"{self.class_type}_number"
+        for pool_id in pool_ids:
+            match = models["pool"].match_criteria(*index["pools"][pool_id], self)
+            if match and pool_id not in pools:
+                pool = db.fetch("pool", id=pool_id, rbac=None)
+                self.pools.append(pool)
                 setattr(pool, number, getattr(pool, number) + 1)
-            if self in getattr(pool, relation) and not match:
-                getattr(pool, relation).remove(self)
+            elif pool_id in pools and not match:
+                pool = pools[pool_id]
+                self.pools.remove(pool)
                 setattr(pool, number, getattr(pool, number) - 1)
 
     def delete(self):
@@ -50,23 +70,10 @@ class Object(AbstractBase):
 
     @classmethod
     def rbac_filter(cls, query, mode, user):
-        public_objects = query.filter(cls.public == true())
-        user_objects = (
-            query.join(cls.pools)
-            .join(models["access"], models["pool"].access)
-            .join(models["user"], models["access"].users)
-            .filter(models["access"].pools_access.contains(mode))
-            .filter(models["user"].name == user.name)
-        )
-        user_group_objects = (
-            query.join(cls.pools)
-            .join(models["access"], models["pool"].access)
-            .join(models["group"], models["access"].groups)
-            .join(models["user"], models["group"].users)
-            .filter(models["access"].pools_access.contains(mode))
-            .filter(models["user"].name == user.name)
+        pool_ids = user.get_rbac_ids("pools", mode)
+        return query.filter(
+            or_(cls.public == true(), cls.pools.any(models["pool"].id.in_(pool_ids)))
         )
-        return public_objects.union(user_objects, user_group_objects)
 
 
 @db.set_custom_properties
@@ -83,6 +90,12 @@ class Device(Object):
     ip_address = db.Column(db.TinyString)
     longitude = db.Column(db.TinyString, default="0.0")
     latitude = db.Column(db.TinyString, default="0.0")
+    longitude_value = db.Column(
+        Float, default=0.0, info={"log_change": False, "model_properties": False}
+    )
+    latitude_value = db.Column(
+        Float, default=0.0, info={"log_change": False, "model_properties": False}
+    )
     port = db.Column(Integer, default=22)
     username = db.Column(db.SmallString)
     password = db.Column(db.SmallString)
@@ -90,11 +103,11 @@ class Device(Object):
     netmiko_driver = db.Column(db.TinyString, default="cisco_ios")
     napalm_driver = db.Column(db.TinyString, default="ios")
     scrapli_driver = db.Column(db.TinyString, default="cisco_iosxe")
-    configuration = db.Column(db.LargeString, info={"log_change": False})
+    configuration = deferred(db.Column(db.LargeString, info={"log_change": False}))
     last_failure = db.Column(db.TinyString, default="Never")
     last_status = db.Column(db.TinyString, default="Never")
     last_update = db.Column(db.TinyString, default="Never")
-    last_runtime = db.Column(db.TinyString)
+    last_runtime = db.Column(db.DateTime, index=True)
     last_duration = db.Column(db.TinyString)
     services = relationship(
         "Service", secondary=db.service_device_table, back_populates="devices"
@@ -115,6 +128,115 @@ class Device(Object):
         "Session", back_populates="device", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (Index("ix_device_position", "latitude_value", "longitude_value"),)
+
+    @classmethod
+    def bulk_properties(cls, **kwargs):
+        properties = super().bulk_properties(**kwargs)
+        for property in ("latitude", "longitude"):
+            if property in properties:
+                properties[f"{property}_value"] = db.coordinate(properties[property])
+        return properties
+
+    def delete(self):
+        super().delete()
+        version_table = models["configuration_version"]
+        versions = db.session.query(version_table).filter_by(device_id=self.id)
+        content_ids = [id for (id,) in versions.with_entities(version_table.content_id)]
+        versions.delete(synchronize_session=False)
+        self.delete_orphaned_content(content_ids)
+
+    def update_configuration(self, property, value, runtime=None):
+        content_table = models["configuration_content"]
+        version_table = models["configuration_version"]
+        hash = sha256(value.encode("utf-8")).hexdigest()
+        latest_hash = (
+            db.session.query(content_table.hash)
+            .join(version_table, version_table.content_id == content_table.id)
+            .filter(
+                version_table.device_id == self.id, version_table.property == property
+            )
+            .order_by(version_table.runtime.desc(), version_table.id.desc())
+            .limit(1)
+            .scalar()
+        )
+        if latest_hash == hash and getattr(self, property) == value:
+            return False
+        if latest_hash or getattr(self, property) != value:
+            setattr(self, property, value)
+        if latest_hash == hash:
+            return True
+        db.session.add(
+            version_table(
+                device_id=self.id,
+                property=property,
+                runtime=runtime or app.get_time(),
+                content=self.get_configuration_content(hash, value),
+            )
+        )
+        db.session.flush()
+        self.prune_configuration_history(property)
+        return True
+
+    def prune_configuration_history(self, property):
+        version_table = models["configuration_version"]
+        stale_versions = (
+            db.session.query(version_table.id, version_table.content_id)
+            .filter_by(device_id=self.id, property=property)
+            .order_by(version_table.runtime.desc(), version_table.id.desc())
+            .offset(db.configuration_history_size)
+            .all()
+        )
+        if not stale_versions:
+            return
+        version_ids, content_ids = zip(*stale_versions)
+        db.session.query(version_table).filter(
+            version_table.id.in_(version_ids)
+        ).delete(synchronize_session=False)
+        self.delete_orphaned_content(content_ids)
+
+    @staticmethod
+    def get_configuration_content(hash, value):
+        content_table = models["configuration_content"]
+        query = db.session.query(content_table).filter_by(hash=hash)
+        content = query.with_for_update(read=True).first()
+        if content:
+            return content
+        try:
+            with db.session.begin_nested():
+                content = content_table(hash=hash, data=value)
+                db.session.add(content)
+            return content
+        except IntegrityError:
+            return query.with_for_update(read=True).one()
+
+    @staticmethod
+    def delete_orphaned_content(content_ids):
+        if not content_ids:
+            return
+        content_table = models["configuration_content"]
+        version_table = models["configuration_version"]
+        orphaned_content = (
+            db.session.query(content_table.id)
+            .filter(
+                content_table.id.in_(set(content_ids)),
+                ~db.session.query(version_table)
+                .filter(version_table.content_id == content_table.id)
+                .exists(),
+            )
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not orphaned_content:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.query(content_table).filter(
+                    content_table.id.in_([id for (id,) in orphaned_content])
+                ).delete(synchronize_session=False)
+        except IntegrityError:
+            pass
+
     def table_properties(self, **kwargs):
         columns = [c["data"] for c in kwargs["columns"]]
         rest_api_request = kwargs.get("rest_api_request")
@@ -171,21 +293,6 @@ class Device(Object):
                     )
         return properties
 
-    @property
-    def view_properties(self):
-        return {
-            property: getattr(self, property)
-            for property in (
-                "id",
-                "type",
-                "name",
-                "icon",
-                "latitude",
-                "longitude",
-                "last_runtime",
-            )
-        }
-
     @property
     def ui_name(self):
         return f"{self.name} ({self.model})" if self.model else self.name
@@ -223,24 +330,6 @@ class Link(Object):
     def __init__(self, **kwargs):
         self.update(**kwargs)
 
-    @property
-    def view_properties(self):
-        node_properties = ("id", "longitude", "latitude")
-        return {
-            **{
-                property: getattr(self, property)
-                for property in ("id", "type", "name", "color")
-            },
-            **{
-                f"source_{property}": getattr(self.source, property)
-                for property in node_properties
-            },
-            **{
-                f"destination_{property}": getattr(self.destination, property)
-                for property in node_properties
-            },
-        }
-
     def update(self, **kwargs):
         if "source_name" in kwargs:
             kwargs["source"] = db.fetch("device", name=kwargs.pop("source_name")).id
@@ -300,67 +389,183 @@ class Pool(AbstractBase):
     )
     manually_defined = db.Column(Boolean, default=False)
 
+    def delete(self):
+        for access in self.access:
+            access.reset_rbac()
+
     def update(self, **kwargs):
         super().update(**kwargs)
         self.compute_pool()
         if not getattr(current_user, "is_admin", True):
             current_user.add_access("pools", self)
 
-    def property_match(self, obj, property):
-        pool_value = getattr(self, f"{obj.class_type}_{property}")
-        object_value = str(getattr(obj, property))
-        match = getattr(self, f"{obj.class_type}_{property}_match")
-        if not pool_value:
-            return True
-        elif match == "inclusion":
-            return pool_value in object_value
-        elif match == "equality":
-            return pool_value == object_value
-        else:
-            return bool(search(pool_value, object_value))
+    def criteria(self, object_type):
+        return [
+            (
+                property,
+                getattr(self, f"{object_type}_{property}"),
+                getattr(self, f"{object_type}_{property}_match"),
+            )
+            for property in properties["filtering"][object_type]
+            if getattr(self, f"{object_type}_{property}")
+        ]
+
+    @staticmethod
+    def match_criteria(operator, criteria, obj):
+        def property_match(property, pool_value, match):
+            object_value = str(getattr(obj, property))
+            if match == "inclusion":
+                return pool_value in object_value
+            elif match == "equality":
+                return pool_value == object_value
+            else:
+                return bool(search(pool_value, object_value))
 
-    def object_match(self, obj):
-        operator = all if self.operator == "all" else any
-        return operator(
-            self.property_match(obj, property)
-            for property in properties["filtering"][obj.class_type]
+        return (any if operator == "any" else all)(
+            property_match(*criterion) for criterion in criteria
         )
 
+    def object_match(self, obj):
+        criteria = self.criteria(obj.class_type)
+        return self.match_criteria(self.operator, criteria, obj)
+
     def compute(self, object_type):
         return any(
             getattr(self, f"{object_type}_{property}")
             for property in properties["filtering"][object_type]
         )
 
+    def object_constraints(self, object_type):
+        table, constraints = models[object_type], []
+        for property in properties["filtering"][object_type]:
+            value = getattr(self, f"{object_type}_{property}")
+            if not value:
+                continue
+            match = getattr(self, f"{object_type}_{property}_match")
+            column = getattr(table, property)
+            if not isinstance(getattr(column, "type", String()), String):
+                column = cast(column, Text)
+            if db.dialect == "mysql":
+                if match not in ("inclusion", "equality"):
+                    return
+                column = func.binary(column)
+            regex_operator = "~" if db.dialect == "postgresql" else "regexp"
+            if match == "inclusion" and db.dialect == "sqlite":
+                constraints.append(column.op(regex_operator)(escape(value)))
+            elif match == "inclusion":
+                constraints.append(column.contains(value, autoescape=True))
+            elif match == "equality":
+                constraints.append(column == value)
+            else:
+                constraints.append(column.op(regex_operator)(value))
+        return (or_ if self.operator == "any" else and_)(*constraints)
+
+    def matching_objects(self, object_type, object_ids=None):
+        query = db.query(object_type)
+        if object_ids is not None:
+            query = query.filter(models[object_type].id.in_(object_ids))
+        constraints = self.object_constraints(object_type)
+        if constraints is None:
+            return list(filter(self.object_match, query.all()))
+        return query.filter(constraints).all()
+
+    def compute_membership(self, object_type, object_ids=None):
+        table, model = getattr(db, f"pool_{object_type}_table"), models[object_type]
+        pool_id, object_id = table.c.pool_id, table.c[f"{object_type}_id"]
+        deletion = table.delete().where(pool_id == self.id)
+        if object_ids is not None:
+            deletion = deletion.where(object_id.in_(object_ids))
+        db.session.execute(deletion)
+        if self.compute(object_type):
+            constraints = self.object_constraints(object_type)
+            if constraints is None:
+                rows = [
+                    {"pool_id": self.id, f"{object_type}_id": obj.id}
+                    for obj in self.matching_objects(object_type, object_ids)
+                ]
+                if rows:
+                    db.session.execute(table.insert(), rows)
+            else:
+                query = (
+                    db.query(object_type)
+                    .with_entities(literal(self.id), model.id)
+                    .filter(constraints)
+                )
+                if object_ids is not None:
+                    query = query.filter(model.id.in_(object_ids))
+                db.session.execute(
+                    table.insert().from_select([pool_id, object_id], query.statement)
+                )
+        count = db.session.query(func.count(object_id)).filter(pool_id == self.id)
+        setattr(self, f"{object_type}_number", count.scalar())
+
     def compute_pool(self):
-        if not self.manually_defined:
+        if self.manually_defined:
+            self.device_number = len(self.devices)
+            self.link_number = len(self.links)
+        elif self.id is None:
             for object_type in ("device", "link"):
                 objects = (
-                    list(filter(self.object_match, db.fetch_all(object_type)))
+                    self.matching_objects(object_type)
                     if self.compute(object_type)
                     else []
                 )
                 setattr(self, f"{object_type}s", objects)
-        self.device_number = len(self.devices)
-        self.link_number = len(self.links)
+                setattr(self, f"{object_type}_number", len(objects))
+        else:
+            db.session.flush()
+            for object_type in ("device", "link"):
+                self.compute_membership(object_type)
+            db.session.expire(self, ["devices", "links"])
 
     @classmethod
     def rbac_filter(cls, query, mode, user):
-        public_pools = query.filter(cls.public == true())
-        user_pools = (
-            query.join(cls.access)
-            .join(models["user"], models["access"].users)
-            .filter(models["access"].pools_access.contains(mode))
-            .filter(models["user"].name == user.name)
-        )
-        user_group_pools = (
-            query.join(cls.access)
-            .join(models["group"], models["access"].groups)
-            .join(models["user"], models["group"].users)
-            .filter(models["access"].pools_access.contains(mode))
-            .filter(models["user"].name == user.name)
-        )
-        return public_pools.union(user_pools, user_group_pools)
+        pool_ids = user.get_rbac_ids("pools", mode)
+        return query.filter(or_(cls.public == true(), cls.id.in_(pool_ids)))
+
+
+class ConfigurationContent(AbstractBase):
+
+    __tablename__ = type = "configuration_content"
+    __table_args__ = (Index("ix_configuration_content_hash_0", "hash", unique=True),)
+    private = True
+    log_change = False
+    id = db.Column(Integer, primary_key=True)
+    hash = db.Column(db.TinyString)
+    content = db.Column(db.LargeBinary)
+
+    def __repr__(self):
+        return self.hash
+
+    @property
+    def data(self):
+        return decompress(self.content).decode("utf-8")
+
+    def update(self, data=None, **kwargs):
+        super().update(**kwargs)
+        if data is not None:
+            self.content = compress(data.encode("utf-8"))
+
+
+class ConfigurationVersion(AbstractBase):
+
+    __tablename__ = type = "configuration_version"
+    __table_args__ = (
+        Index(
+            "ix_configuration_version_device_id_0", "device_id", "property", "runtime"
+        ),
+    )
+    private = True
+    log_change = False
+    id = db.Column(Integer, primary_key=True)
+    device_id = db.Column(Integer, ForeignKey("device.id", ondelete="cascade"))
+    property = db.Column(db.SmallString)
+    runtime = db.Column(db.DateTime)
+    content_id = db.Column(Integer, ForeignKey("configuration_content.id"))
+    content = relationship("ConfigurationContent")
+
+    def __repr__(self):
+        return f"{self.property} ({self.runtime})"
 
 
 class Session(AbstractBase):
@@ -369,7 +574,7 @@ class Session(AbstractBase):
     private = True
     id = db.Column(Integer, primary_key=True)
     name = db.Column(db.SmallString, unique=True)
-    timestamp = db.Column(db.TinyString)
+    timestamp = db.Column(db.DateTime, index=True)
     user = db.Column(db.SmallString)
     content = db.Column(db.LargeString, info={"log_change": False})
     device_id = db.Column(Integer, ForeignKey("device.id"))
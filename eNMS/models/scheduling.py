@@ -5,8 +5,7 @@ from requests.exceptions import ConnectionError, MissingSchema, ReadTimeout
 from sqlalchemy import Boolean, case, ForeignKey, Integer
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import aliased, relationship
-from sqlalchemy.sql.expression import true
+from sqlalchemy.orm import relationship
 
 from eNMS import app
 from eNMS.database import db
@@ -57,28 +56,8 @@ class Task(AbstractBase):
     @classmethod
     def rbac_filter(cls, query, mode, user):
         service_mode = "read" if mode == "read" else "schedule"
-        public_tasks = query.join(cls.service).filter(
-            models["service"].public == true()
-        )
-        service_alias = aliased(models["service"])
-        user_tasks = (
-            query.join(cls.service)
-            .join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["user"], models["access"].users)
-            .filter(models["access"].services_access.contains(service_mode))
-            .filter(models["user"].name == user.name)
-        )
-        user_group_tasks = (
-            query.join(cls.service)
-            .join(models["service"].originals.of_type(service_alias))
-            .join(models["access"], service_alias.access)
-            .join(models["group"], models["access"].groups)
-            .join(models["user"], models["group"].users)
-            .filter(models["access"].services_access.contains(service_mode))
-            .filter(models["user"].name == user.name)
-        )
-        return public_tasks.union(user_tasks, user_group_tasks)
+        criterion = models["service"].rbac_criterion(service_mode, user)
+        return query.join(cls.service).filter(criterion)
 
     def _catch_request_exceptions(func):  # noqa: N805
         @wraps(func)
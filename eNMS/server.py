@@ -1,4 +1,3 @@
-from collections import defaultdict
 from datetime import timedelta
 from flask import (
     abort,
@@ -10,7 +9,9 @@ from flask import (
     redirect,
     render_template,
     request,
+    Response,
     send_file,
+    stream_with_context,
     url_for,
     session,
 )
@@ -80,7 +81,8 @@ class Server(Flask):
                     and request.path not in current_user.get_requests
                 ):
                     return render_template("error.html", error=403), 403
-                return function(*args, **kwargs)
+                with db.monitor_queries("/".join(request.path.split("/")[:2])):
+                    return function(*args, **kwargs)
 
         return decorated_function
 
@@ -292,7 +294,11 @@ class Server(Flask):
         @blueprint.route("/view_service_results/<int:id>")
         @self.monitor_requests
         def view_service_results(id):
-            result = db.fetch("run", id=id).result().result
+            if db.fetch("run", allow_none=True, rbac=None, id=id):
+                run = db.fetch("run", allow_none=True, id=id)
+                result = run.result().result if run else None
+            else:
+                result = (app.get_archived_result(id, run=True) or {}).get("result")
             return f"<pre>{app.str_dict(result)}</pre>"
 
         @blueprint.route("/download_file/<path:path>")
@@ -300,6 +306,26 @@ class Server(Flask):
         def download_file(path):
             return send_file(f"/{path}", as_attachment=True)
 
+        @blueprint.route("/stream_topology")
+        @self.monitor_requests
+        def stream_topology():
+            export_format = request.args.get("format", "xlsx")
+            model = request.args.get("model", "device")
+            if model not in ("device", "link"):
+                abort(400)
+            if export_format == "csv":
+                filename, mimetype = f"{model}.csv", "text/csv"
+            else:
+                filename = "topology.xlsx"
+                mimetype = (
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            return Response(
+                stream_with_context(app.stream_topology(export_format, model)),
+                mimetype=mimetype,
+                headers={"Content-Disposition": f"attachment; filename={filename}"},
+            )
+
         @blueprint.route("/<path:_>")
         @self.monitor_requests
         def get_requests_sink(_):
@@ -342,7 +368,8 @@ class Server(Flask):
         def wrapper(*args, **kwargs):
             for index in range(db.retry_commit_number):
                 try:
-                    result = func(*args, **kwargs)
+                    with db.monitor_queries("/".join(request.path.split("/")[:3])):
+                        result = func(*args, **kwargs)
                 except db.rbac_error as exc:
                     return rest_abort(404, message=str(exc))
                 except Exception as exc:
@@ -374,12 +401,16 @@ class Server(Flask):
                     **{
                         "name": data["name"],
                         "devices": [
-                            db.fetch("device", name=name).id
-                            for name in data.get("devices", "")
+                            device.id
+                            for device in db.objectify(
+                                "device", data.get("devices", ""), key="name"
+                            )
                         ],
                         "links": [
-                            db.fetch("link", name=name).id
-                            for name in data.get("links", "")
+                            link.id
+                            for link in db.objectify(
+                                "link", data.get("links", ""), key="name"
+                            )
                         ],
                         "manually_defined": True,
                     },
@@ -391,14 +422,24 @@ class Server(Flask):
                 return {
                     "name": getnode(),
                     "cluster_id": app.settings["cluster"]["id"],
+                    "fetch_cache": db.fetch_cache_info(),
+                    "vault_cache": app.vault_cache_info(),
+                    "changelog": app.changelog_info(),
                 }
 
         class Query(Resource):
-            decorators = [self.auth.login_required, self.monitor_rest_request]
+            decorators = [
+                self.auth.login_required,
+                self.monitor_rest_request,
+                db.read_only,
+            ]
 
             def get(self, model):
-                properties = request.args.to_dict()
-                results = db.fetch(model, all_matches=True, **properties)
+                query = db.query(model).filter_by(**request.args.to_dict())
+                properties = db.get_serializer(model, exclude=["positions"])[0]
+                query = db.load_properties(query, model, properties)
+                options = db.get_loader_options(model, properties)
+                results = query.options(*options).all()
                 return [
                     result.get_properties(exclude=["positions"]) for result in results
                 ]
@@ -445,20 +486,10 @@ class Server(Flask):
             decorators = [self.auth.login_required, self.monitor_rest_request]
 
             def post(self, model):
-                data, result = request.get_json(force=True), defaultdict(list)
+                data = request.get_json(force=True)
                 if not isinstance(data, list):
                     data = [data]
-                for instance in data:
-                    if "name" not in instance:
-                        result["failure"].append((instance, "Name is missing"))
-                        continue
-                    try:
-                        object_data = app.objectify(model, instance)
-                        instance = db.factory(model, **object_data)
-                        result["success"].append(instance.name)
-                    except Exception:
-                        result["failure"].append((instance, format_exc()))
-                return result
+                return db.bulk_factory(model, data)
 
         class Migrate(Resource):
             decorators = [self.auth.login_required, self.monitor_rest_request]
@@ -535,6 +566,7 @@ class Server(Flask):
                         **{
                             "replace": request.form["replace"] == "True",
                             "file": request.files["file"],
+                            "job_id": request.form.get("job_id"),
                         }
                     )
                     status = 206 if "Partial" in result else 200
@@ -56,9 +56,11 @@ class NapalmBackupService(ConnectionService):
                 except Exception as exc:
                     result[getter] = f"{getter} failed because of {exc}"
             result = app.str_dict(result)
-            setattr(device, self.property, result)
-            with open(path / self.property, "w") as file:
-                file.write(result)
+            runtime = str(device.last_runtime)
+            changed = device.update_configuration(self.property, result, runtime)
+            if changed or not (path / self.property).exists():
+                with open(path / self.property, "w") as file:
+                    file.write(result)
             device.last_status = "Success"
             device.last_duration = (
                 f"{(datetime.now() - device.last_runtime).total_seconds()}s"
@@ -73,9 +73,11 @@ class NetmikoBackupService(ConnectionService):
             result = "\n\n".join(result)
             for r in self.replacements:
                 result = sub(r["pattern"], r["replace_with"], result, flags=M)
-            setattr(device, self.property, result)
-            with open(path / self.property, "w") as file:
-                file.write(result)
+            runtime = str(device.last_runtime)
+            changed = device.update_configuration(self.property, result, runtime)
+            if changed or not (path / self.property).exists():
+                with open(path / self.property, "w") as file:
+                    file.write(result)
             device.last_status = "Success"
             device.last_duration = (
                 f"{(datetime.now() - device.last_runtime).total_seconds()}s"
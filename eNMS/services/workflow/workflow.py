@@ -43,6 +43,7 @@ class Workflow(Service):
             end.positions[self.name] = (500, 0)
 
     def delete(self):
+        super().delete()
         for service in self.services:
             if not service.shared:
                 db.delete("service", id=service.id)
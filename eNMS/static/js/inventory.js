@@ -491,9 +491,31 @@ function exportTopology() {
   });
 }
 
+let importJob;
+
+function showImportProgress(jobId) {
+  if (jobId != importJob) return;
+  call({
+    url: `/get_import_job/${jobId}`,
+    callback: function (job) {
+      if (job && job.status == "Running") {
+        const progress = Object.entries(job.progress)
+          .map(([model, count]) => `${count} ${model}s`)
+          .join(", ");
+        notify(`Topology import: ${progress} processed.`, "success", 5);
+      }
+      setTimeout(() => showImportProgress(jobId), 5000);
+    },
+  });
+}
+
 function importTopology() {
   notify("Topology import: starting...", "success", 5, true);
   const formData = new FormData($("#import-form")[0]);
+  const jobId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  formData.append("job_id", jobId);
+  importJob = jobId;
+  setTimeout(() => showImportProgress(jobId), 5000);
   $.ajax({
     type: "POST",
     url: "/import_topology",
@@ -505,6 +527,9 @@ function importTopology() {
     success: function (result) {
       notify(result, "success", 5, true);
     },
+    complete: function () {
+      importJob = null;
+    },
   });
 }
 
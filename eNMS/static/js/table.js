@@ -125,6 +125,8 @@ export class Table {
             columns: this.columns,
             type: this.type,
             export: self.csvExport,
+            keyset: self.keyset,
+            count_filtered: !self.periodicRefresh,
           });
           Object.assign(d, self.filteringData);
           if (this.runtime) {
@@ -137,6 +139,11 @@ export class Table {
             notify(result.error, "error", 5);
             return [];
           }
+          if (result.recordsFiltered === undefined) {
+            result.recordsFiltered = self.recordsFiltered;
+          }
+          self.recordsFiltered = result.recordsFiltered;
+          self.keyset = result.keyset;
           if (self.csvExport) {
             self.exportTable(result.full_result);
             self.csvExport = false;
@@ -1159,7 +1166,12 @@ export const refreshTable = function (tableId, notification) {
 };
 
 function refreshTablePeriodically(tableId, interval, first) {
-  if (userIsActive && !first) refreshTable(tableId, false);
+  if (userIsActive && !first) {
+    const table = tableInstances[tableId];
+    table.periodicRefresh = table.recordsFiltered !== undefined;
+    refreshTable(tableId, false);
+    table.periodicRefresh = false;
+  }
   setTimeout(() => refreshTablePeriodically(tableId, interval), interval);
 }
 
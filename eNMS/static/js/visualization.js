@@ -44,6 +44,7 @@ let map;
 let markerGroup;
 let clustered;
 let selected;
+let filters = {};
 let logicalDevices = [];
 let logicalLinks = [];
 let routerIcon;
@@ -128,6 +129,49 @@ function createLink(link) {
   polyline.addTo(map);
 }
 
+function createCluster(cluster) {
+  const marker = L.marker([cluster.latitude, cluster.longitude], {
+    icon: L.divIcon({
+      html: `<div><span>${cluster.count}</span></div>`,
+      className: "marker-cluster marker-cluster-medium",
+      iconSize: L.point(40, 40),
+    }),
+  });
+  marker.bindTooltip(`${cluster.count} devices`, { permanent: false });
+  marker.on("click", function (e) {
+    map.setView(
+      [cluster.latitude, cluster.longitude],
+      settings.view.cluster_zoom_level
+    );
+  });
+  markersArray.push(marker);
+  if (clustered) {
+    markerGroup.addLayer(marker);
+  } else {
+    marker.addTo(map);
+  }
+}
+
+function getViewport() {
+  const bounds = map.getBounds();
+  return {
+    bounds: {
+      south: bounds.getSouth(),
+      west: bounds.getWest(),
+      north: bounds.getNorth(),
+      east: bounds.getEast(),
+    },
+    zoom: map.getZoom(),
+  };
+}
+
+function displayTopology(topology) {
+  deleteAll();
+  topology.clusters.map(createCluster);
+  topology.devices.map((d) => createNode(d, "device"));
+  topology.links.map(createLink);
+}
+
 function deleteAllDevices() {
   for (let i = 0; i < markersArray.length; i++) {
     if (clustered) {
@@ -164,11 +208,9 @@ function updateView(withCluster) {
   clustered = withCluster;
   if (viewType == "network") {
     call({
-      url: "/get_view_topology",
-      callback: function (topology) {
-        topology.devices.map((d) => createNode(d, "device"));
-        topology.links.map(createLink);
-      },
+      url: "/view_filtering",
+      data: { ...filters, ...getViewport() },
+      callback: displayTopology,
     });
   } else {
     $(".menu").hide();
@@ -293,6 +335,9 @@ export function initView() {
       }
     });
   updateView();
+  map.on("moveend", function () {
+    if (viewType == "network") updateView(clustered);
+  });
   $("body").contextMenu({
     menuSelector: "#contextMenu",
     menuSelected: function (selectedMenu) {
@@ -326,17 +371,15 @@ export function initView() {
 }
 
 function filterView() {
-  const data = {
+  filters = {
     device: { form: serializeForm(`#device-filtering-form`) },
     link: { form: serializeForm(`#link-filtering-form`) },
   };
   call({
     url: "/view_filtering",
-    data: data,
-    callback: function (results) {
-      deleteAll();
-      results.device.map((d) => createNode(d, "device"));
-      results.link.map(createLink);
+    data: { ...filters, ...getViewport() },
+    callback: function (topology) {
+      displayTopology(topology);
       notify("Filter applied.", "success", 5);
     },
   });
@@ -0,0 +1,32 @@
+from os import environ
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+database = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{database.name}/benchmark.db"
+environ.pop("DATABASE_READ_URL", None)
+
+from eNMS.database import db
+from eNMS.server import Server
+
+DEVICES = 5000
+ROUNDS = 5
+
+Server("test")
+db.delete_all("device")
+db.bulk_factory("device", [{"name": f"bench{index}"} for index in range(DEVICES)])
+devices = db.fetch_all("device")
+
+start = perf_counter()
+for _ in range(ROUNDS):
+    for device in devices:
+        device.get_properties()
+duration = perf_counter() - start
+print(f"get_properties: {DEVICES * ROUNDS / duration:.0f} calls/s")
+
+start = perf_counter()
+for _ in range(ROUNDS):
+    for device in devices:
+        device.name, device.vendor, device.model, device.password
+duration = perf_counter() - start
+print(f"Attribute access: {DEVICES * ROUNDS * 4 / duration:.0f} reads/s")
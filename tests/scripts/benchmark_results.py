@@ -0,0 +1,68 @@
+from os import environ
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+database = TemporaryDirectory()
+environ["DATABASE_URL"] = f"sqlite:///{database.name}/benchmark.db"
+environ.pop("DATABASE_READ_URL", None)
+
+from eNMS.database import db
+from eNMS.models import models
+from eNMS.server import Server
+
+DEVICES = 10000
+
+Server("test")
+db.delete_all("device")
+db.bulk_factory("device", [{"name": f"bench{index}"} for index in range(DEVICES)])
+service = db.fetch("service", name="[Shared] Start")
+run = db.factory("run", service=service.id, creator="admin", commit=True)
+devices = db.fetch_all("device")
+common = {
+    "run_id": run.id,
+    "service_id": service.id,
+    "parent_runtime": run.parent_runtime,
+    "runtime": run.runtime,
+    "success": True,
+    "duration": "0:00:00",
+}
+db.session.bulk_insert_mappings(
+    models["result"],
+    [
+        {"device_id": device.id, "result": {"index": index}, **common}
+        for index, device in enumerate(devices)
+    ],
+)
+db.session.commit()
+
+start = perf_counter()
+for device in devices:
+    db.fetch(
+        "result",
+        service_id=service.id,
+        parent_runtime=run.parent_runtime,
+        device_id=device.id,
+        allow_none=True,
+    )
+print(f"Per-device lookups: {perf_counter() - start:.2f}s")
+
+start = perf_counter()
+result = models["result"]
+dict(
+    db.session.query(result.device_id, result.result).filter(
+        result.parent_runtime == run.parent_runtime,
+        result.service_id == service.id,
+        result.device_id.isnot(None),
+    )
+)
+print(f"Bulk lookup: {perf_counter() - start:.2f}s")
+
+start = perf_counter()
+for device in devices[:100]:
+    [result for result in run.results if result.device_name == device.name]
+print(f"Run results scan for 100 devices: {perf_counter() - start:.2f}s")
+
+start = perf_counter()
+for device in devices[:100]:
+    run.result(device.name)
+print(f"Run.result for 100 devices: {perf_counter() - start:.2f}s")
@@ -1,5 +1,10 @@
+from pickle import dumps
+from sqlalchemy import event, inspect, text
+from threading import Thread
+
 from eNMS import app
 from eNMS.database import db
+from eNMS.models import models
 
 from tests.conftest import check_pages
 
@@ -55,3 +60,182 @@ def test_user_management(user_client):
     user1 = db.fetch("user", name="user1")
     user_client.post("/delete_instance/user/{}".format(user1.id))
     assert len(db.fetch_all("user")) == 7
+
+
+def test_rbac_access_ids(user_client):
+    devices = [db.factory("device", name=f"rbac{index}") for index in range(3)]
+    user = db.factory("user", name="rbac_user", commit=True)
+    group = db.factory("group", name="rbac_group", users=[user.id], commit=True)
+    pool = db.factory("pool", name="rbac_pool", manually_defined=True, commit=True)
+    pool.devices = devices[:2]
+    access = {"menu": [], "pages": [], "upper_menu": []}
+    access.update(get_requests=[], post_requests=[], pools_access="['Read']")
+    db.factory("access", name="rbac", groups=[group.id], pools=[pool.id], **access)
+    db.session.commit()
+    assert user.rbac_ids["pools"]["read"] == [pool.id]
+    readable_devices = db.query("device", rbac="read", username="rbac_user").all()
+    assert set(devices[:2]) <= set(readable_devices)
+    assert devices[2] not in readable_devices
+    assert pool not in db.query("pool", rbac="edit", username="rbac_user").all()
+    db.delete_instance(pool)
+    db.session.commit()
+    assert not user.rbac_ids
+    db.query("pool", rbac="read", username="rbac_user").all()
+    assert not db.session.dirty
+    assert not user.rbac_ids["pools"]["read"]
+
+
+def test_query_statistics(user_client):
+    user_client.get("/table/device")
+    with db.monitor_queries("n_plus_one"):
+        for device in db.fetch_all("device"):
+            device.pools
+    statistics = app.get_query_statistics()
+    assert statistics["/table"]["queries"] > 0
+    assert statistics["n_plus_one"]["n_plus_one"]
+
+
+def test_run_archive(user_client):
+    service = db.fetch("service", name="[Shared] Start")
+    runtime = app.run(service.id, creator="admin")["runtime"]
+    run = db.fetch("run", runtime=runtime)
+    run_id, result_id = run.id, run.result().id
+    assert app.archive_runs("9999-01-01") >= 1
+    assert not db.fetch("run", allow_none=True, id=run_id)
+    assert app.get_result(result_id)["runtime"] == runtime
+    assert app.get_archived_result(run_id, run=True)["id"] == result_id
+    assert user_client.get(f"/view_service_results/{run_id}").status_code == 200
+    app.result_log_deletion(
+        date_time="01/01/1970 00:00:00",
+        deletion_types=["run_archive", "run", "changelog"],
+    )
+    assert app.get_archived_result(run_id, run=True)["id"] == result_id
+
+
+def test_multiprocessing_run_results(user_client):
+    devices = [db.factory("device", name=f"process{index}") for index in range(12)]
+    db.session.commit()
+    service = db.factory(
+        "python_snippet_service",
+        name="multiprocessing_snippet",
+        scoped_name="multiprocessing_snippet",
+        devices=[device.id for device in devices],
+        multiprocessing=True,
+        max_processes=4,
+        source_code="results.update(success=True, result=device.name)",
+    )
+    db.session.commit()
+    runtime = app.run(service.id, creator="admin")["runtime"]
+    run = db.fetch("run", runtime=runtime)
+    results = db.query("result").filter(
+        models["result"].run_id == run.id, models["result"].device_id.isnot(None)
+    )
+    assert sorted(result.result["result"] for result in results) == sorted(
+        device.name for device in devices
+    )
+    assert run.success
+
+
+def test_run_get_result(user_client):
+    service = db.fetch("service", name="[Shared] Start")
+    runtime = app.run(service.id, creator="admin")["runtime"]
+    run = db.fetch("run", runtime=runtime)
+    assert "success" in run.get_result("[Shared] Start")
+    assert run.get_result("[Shared] Start", workflow="[Shared] Start") is None
+
+
+def test_legacy_column_conversion(user_client):
+    workflow_id = db.fetch_all("workflow")[0].id
+    labels = {"legacy": {"positions": [1, 2], "content": "pickled"}}
+    with db.engine.begin() as connection:
+        for statement in (
+            "ALTER TABLE workflow DROP COLUMN labels",
+            "ALTER TABLE workflow ADD COLUMN labels BLOB",
+            "DROP INDEX ix_changelog_time",
+            "ALTER TABLE changelog DROP COLUMN time",
+            "ALTER TABLE changelog ADD COLUMN time VARCHAR(64)",
+        ):
+            connection.execute(text(statement))
+        connection.execute(
+            text("UPDATE workflow SET labels = :labels WHERE id = :id"),
+            labels=dumps(labels),
+            id=workflow_id,
+        )
+        connection.execute(
+            text("INSERT INTO changelog (type, content, time) VALUES (:t, :c, '')"),
+            t="changelog",
+            c="legacy",
+        )
+    db.session.close()
+    db.convert_pickled_columns()
+    db.convert_datetime_columns()
+    db.create_missing_indexes()
+    assert db.fetch("workflow", id=workflow_id).labels == labels
+    query = text("SELECT time FROM changelog WHERE content = 'legacy'")
+    assert db.session.execute(query).scalar() is None
+    assert "ix_changelog_time" in {
+        index["name"] for index in inspect(db.engine).get_indexes("changelog")
+    }
+
+
+def test_sqlite_concurrent_writes(user_client):
+    with db.engine.connect() as connection:
+        for pragma, value in (
+            ("journal_mode", "wal"),
+            ("busy_timeout", 30000),
+            ("synchronous", 1),
+        ):
+            assert connection.execute(text(f"PRAGMA {pragma}")).scalar() == value
+    errors = []
+
+    def write(index):
+        try:
+            for number in range(10):
+                db.factory("changelog", content=f"concurrent write {index}-{number}")
+                db.session.commit()
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            db.session.remove()
+
+    threads = [Thread(target=write, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    changelogs = db.query("changelog").filter(
+        models["changelog"].content.like("concurrent write %")
+    )
+    assert changelogs.count() == 80
+
+
+def test_datetime_string_format(user_client):
+    device = db.factory("device", name="datetime_device")
+    device.last_runtime = "2020-01-01 00:00:00"
+    db.session.commit()
+    db.session.expire(device)
+    assert device.last_runtime == "2020-01-01 00:00:00.000000"
+
+
+def test_read_replica_routing(user_client):
+    read_engine, statements = db.configure_engine(db.database_url), []
+    event.listen(
+        read_engine, "before_cursor_execute", lambda *args: statements.append(args)
+    )
+    db.read_engine, replica_lag, db.replica_lag = read_engine, db.replica_lag, 0
+    try:
+        response = user_client.post("/count_models", json={})
+        assert response.json["counters"]["device"] == db.query("device").count()
+        assert statements
+        statements.clear()
+        user_client.post("/update/device", json={"name": "replica_device"})
+        assert not statements
+        assert db.fetch("device", name="replica_device")
+        db.replica_lag = 60
+        user_client.post("/update/device", json={"name": "replica_device2"})
+        user_client.post("/count_models", json={})
+        assert not statements
+    finally:
+        db.read_engine, db.replica_lag = None, replica_lag
+        read_engine.dispose()
@@ -1,8 +1,13 @@
+from csv import reader
+from io import BytesIO
+from pytest import raises
+from unittest.mock import ANY
 from werkzeug.datastructures import ImmutableMultiDict
 
 from eNMS import app
 from eNMS.database import db
-from eNMS.setup import properties
+from eNMS.models import models
+from eNMS.setup import properties, settings
 
 from tests.conftest import check_pages
 
@@ -140,6 +145,367 @@ def test_pool_management(user_client):
     assert len(p2.devices) == 12
     assert len(p2.links) == 4
     assert len(db.fetch_all("pool")) == 11
+    app.update_all_pools()
+    assert p1.device_number == len(p1.devices) == 21
+    assert p2.link_number == len(p2.links) == 4
     # user_client.post(f"/delete_instance/pool/{p1.id}")
     # user_client.post(f"/delete_instance/pool/{p2.id}")
     # assert len(db.fetch_all("pool")) == 9
+
+
+def test_bulk_factory(user_client):
+    db.delete_all("device", "link")
+    devices = [{"name": f"bulk{index}", "vendor": "Cisco"} for index in range(10)]
+    result = db.bulk_factory("device", devices + [{"vendor": "Juniper"}])
+    assert len(result["success"]) == 10
+    assert len(result["failure"]) == 1
+    assert len(db.fetch_all("device")) == 10
+    result = db.bulk_factory("device", [{"name": "bulk0", "vendor": "Arista"}])
+    assert db.fetch("device", name="bulk0").vendor == "Arista"
+    app.flush_changelog()
+    changelog = db.query("changelog").with_entities(models["changelog"].content)
+    contents = {content for (content,) in changelog}
+    assert "CREATION: device 'bulk0'" in contents
+    assert "UPDATE: device 'bulk0': (vendor: 'Cisco' => 'Arista')" in contents
+    count = changelog.count()
+    db.bulk_factory("device", [{"name": "bulk0", "vendor": "Arista"}])
+    app.flush_changelog()
+    assert changelog.count() == count
+    link = {"name": "bulk_link", "source_name": "bulk0", "destination_name": "bulk1"}
+    assert db.bulk_factory("link", [link])["success"] == ["bulk_link"]
+    assert db.fetch("link", name="bulk_link").source.name == "bulk0"
+    pool = db.factory("pool", name="bulk_pool", device_vendor="Arista", commit=True)
+    result = db.bulk_factory("device", [{"name": "bulk1", "vendor": "Arista"}])
+    assert {device.name for device in pool.devices} == {"bulk0", "bulk1"}
+    assert pool.device_number == 2
+    workflows = [
+        {"name": "bulk_workflow", "scoped_name": "bulk_workflow"},
+        {
+            "name": "bulk_child",
+            "scoped_name": "bulk_child",
+            "workflows": ["bulk_workflow"],
+        },
+    ]
+    result = db.bulk_factory("workflow", workflows[::-1])
+    assert sorted(result["success"]) == ["bulk_child", "bulk_workflow"]
+    assert db.fetch("workflow", name="bulk_child").workflows[0].name == "bulk_workflow"
+
+
+def test_fetch_cache(user_client):
+    db.delete_all("device")
+    device = db.factory("device", name="cached", commit=True)
+    assert db.fetch("device", name="cached").id == device.id
+    hits = db.fetch_cache_info()["hits"]
+    assert db.fetch("device", name="cached").id == device.id
+    assert db.fetch_cache_info()["hits"] > hits
+    device.name = "renamed"
+    db.session.commit()
+    assert not db.fetch("device", allow_none=True, name="cached")
+    assert db.fetch("device", name="renamed").id == device.id
+    db.delete("device", name="renamed")
+    db.session.commit()
+    assert not db.fetch("device", allow_none=True, name="renamed")
+
+
+def test_objectify(user_client):
+    db.delete_all("device")
+    db.bulk_factory("device", [{"name": f"obj{index}"} for index in range(5)])
+    names = ["obj3", "obj1", "obj3"]
+    devices = db.objectify("device", names, key="name")
+    assert [device.name for device in devices] == names
+    ids = [str(device.id) for device in devices]
+    assert db.objectify("device", ids) == devices
+    assert len(db.objectify("device", ["obj1", "none"], "name", True)) == 1
+    with raises(db.rbac_error, match="{'name': 'none'}"):
+        db.objectify("device", ["none"], key="name")
+
+
+def test_keyset_filtering(user_client):
+    db.delete_all("device")
+    db.bulk_factory("device", [{"name": f"page{index:02}"} for index in range(25)])
+    kwargs = {
+        "draw": 1,
+        "columns": [{"data": "name"}],
+        "order": [{"column": 0, "dir": "asc"}],
+        "start": 0,
+        "length": 10,
+        "form": {},
+    }
+    first_page = app.filtering("device", **kwargs)
+    assert first_page["keyset"]["anchors"] == {"10": ["page09", ANY]}
+    kwargs.update(start=10, keyset=first_page["keyset"])
+    second_page = app.filtering("device", **kwargs)
+    assert [device["name"] for device in second_page["data"]] == [
+        f"page{index:02}" for index in range(10, 20)
+    ]
+    assert set(second_page["keyset"]["anchors"]) == {"10", "20"}
+    for start, keyset in ((10, second_page["keyset"]), (0, second_page["keyset"])):
+        kwargs.update(start=start, keyset=keyset)
+        page = app.filtering("device", **kwargs)
+        assert [device["name"] for device in page["data"]] == [
+            f"page{index:02}" for index in range(start, start + 10)
+        ]
+    kwargs.update(start=15, keyset=first_page["keyset"], length=5)
+    page = app.filtering("device", **kwargs)
+    assert [device["name"] for device in page["data"]] == [
+        f"page{index:02}" for index in range(15, 20)
+    ]
+    kwargs.update(start=10, form={"name": "page1"}, length=10)
+    page = app.filtering("device", **kwargs)
+    assert page["keyset"]["signature"] != first_page["keyset"]["signature"]
+    assert not page["data"]
+    assert len(app.count_cache) <= settings["database"]["count_cache_size"]
+
+
+class FakeVault:
+    def __init__(self):
+        self.secrets, self.reads = {}, 0
+
+    def read(self, path):
+        self.reads += 1
+        return self.secrets.get(path)
+
+    def write(self, path, data):
+        self.secrets[path] = {"data": {"data": data}}
+
+
+def test_vault_cache(user_client):
+    db.delete_all("device")
+    device = db.factory("device", name="vaulted", commit=True)
+    vault_client = getattr(app, "vault_client", None)
+    app.use_vault, app.vault_client = True, FakeVault()
+    try:
+        device.password = "secret"
+        assert app.get_password(device.password) == "secret"
+        assert app.get_password(device.password) == "secret"
+        assert app.vault_client.reads == 0
+        app.vault_cache.clear()
+        misses = app.vault_cache_info()["misses"]
+        for _ in range(3):
+            assert app.get_password(device.password) == "secret"
+        assert app.vault_client.reads == 1
+        assert app.vault_cache_info()["misses"] == misses + 1
+        app.evict_secrets("secret/data/device/vaulted/")
+        assert app.get_password(device.password) == "secret"
+        assert app.vault_client.reads == 2
+        db.bulk_factory("device", [{"name": "vaulted", "password": "rotated"}])
+        assert app.get_password(device.password) == "rotated"
+    finally:
+        app.use_vault, app.vault_client = False, vault_client
+        app.vault_cache.clear()
+        db.delete("device", name="vaulted")
+        db.session.commit()
+
+
+def test_pool_membership_index(user_client):
+    db.delete_all("device")
+    device = db.factory("device", name="indexed", vendor="Cisco", commit=True)
+    pool = db.factory("pool", name="indexed_pool", device_vendor="Juniper")
+    db.session.commit()
+    assert not pool.devices and pool.device_number == 0
+    device.update(vendor="Juniper")
+    db.session.commit()
+    assert pool.devices == [device] and pool.device_number == 1
+    device.update(description="unrelated")
+    db.session.commit()
+    assert pool.devices == [device] and pool.device_number == 1
+    pool.update(device_vendor="Arista")
+    db.session.commit()
+    device.update(vendor="Arista")
+    db.session.commit()
+    assert pool.devices == [device]
+    device.update(vendor="Cisco")
+    db.session.commit()
+    assert not pool.devices and pool.device_number == 0
+    db.delete("pool", name="indexed_pool")
+    db.session.commit()
+
+
+def test_configuration_search(user_client):
+    db.delete_all("device")
+    db.factory("device", name="searched", configuration="router ospf 1", commit=True)
+    kwargs = {
+        "draw": 1,
+        "columns": [{"data": "name"}, {"data": "configuration"}],
+        "order": [{"column": 0, "dir": "asc"}],
+        "start": 0,
+        "length": 10,
+        "form": {"configuration": "OSPF 1"},
+    }
+    result = app.filtering("device", **kwargs)
+    assert [device["name"] for device in result["data"]] == ["searched"]
+    assert "<mark>ospf 1</mark>" in result["data"][0]["configuration"]
+    db.fetch("device", name="searched").configuration = "router bgp 1"
+    db.session.commit()
+    assert not app.filtering("device", **kwargs)["data"]
+    kwargs["form"]["configuration"] = "bgp"
+    assert app.filtering("device", **kwargs)["recordsFiltered"] == 1
+    db.delete("device", name="searched")
+    db.session.commit()
+    assert not app.filtering("device", **kwargs)["data"]
+
+
+def test_configuration_versions(user_client):
+    db.delete_all("device")
+    device = db.factory("device", name="versioned", commit=True)
+    assert device.update_configuration("configuration", "hostname r1")
+    assert not device.update_configuration("configuration", "hostname r1")
+    assert device.update_configuration("configuration", "hostname r2")
+    device.configuration = "hostname r3"
+    assert device.update_configuration("configuration", "hostname r2")
+    assert device.configuration == "hostname r2"
+    other = db.factory("device", name="other", commit=True)
+    assert other.update_configuration("configuration", "hostname r2")
+    db.session.commit()
+    assert len(db.fetch_all("configuration_content", rbac=None)) == 2
+    history = app.get_configuration_history(device.id)["configuration"]
+    assert len(history) == 2
+    assert app.get_configuration_version(history[0]["id"]) == "hostname r2"
+    assert app.get_configuration_version(history[1]["id"]) == "hostname r1"
+    db.delete_all("device")
+    assert not db.fetch_all("configuration_version", rbac=None)
+    assert not db.fetch_all("configuration_content", rbac=None)
+
+
+def test_view_topology(user_client):
+    db.delete_all("link", "device")
+    db.bulk_factory(
+        "device",
+        [
+            {"name": "paris", "latitude": "48.85", "longitude": "2.35"},
+            {"name": "lyon", "latitude": "45.76", "longitude": "4.83"},
+            {"name": "tokyo", "latitude": "35.68", "longitude": "139.69"},
+            {"name": "unpositioned"},
+        ],
+    )
+    db.factory(
+        "link", name="paris-tokyo", source_name="paris", destination_name="tokyo"
+    )
+    db.fetch("device", name="lyon").latitude = "46.2"
+    db.session.commit()
+    europe = {"south": 40, "west": -10, "north": 55, "east": 20}
+    topology = app.view_filtering(bounds=europe, zoom=6)
+    assert {device["name"] for device in topology["devices"]} == {"paris", "lyon"}
+    assert (
+        next(d for d in topology["devices"] if d["name"] == "lyon")["latitude"] == 46.2
+    )
+    assert [link["name"] for link in topology["links"]] == ["paris-tokyo"]
+    assert topology["links"][0]["destination_longitude"] == 139.69
+    pacific = {"south": 20, "west": 120, "north": 50, "east": 190}
+    topology = app.view_filtering(bounds=pacific, zoom=6)
+    assert [device["name"] for device in topology["devices"]] == ["tokyo"]
+    clusters = app.view_filtering(zoom=1)["clusters"]
+    assert sorted(cluster["count"] for cluster in clusters) == [1, 1, 2]
+    devices = app.view_filtering(zoom=6)["devices"]
+    assert sum(cluster["count"] for cluster in clusters) == len(devices)
+    filtering = {"device": {"form": {"name": "paris"}}}
+    topology = app.view_filtering(bounds=europe, zoom=6, **filtering)
+    assert [device["name"] for device in topology["devices"]] == ["paris"]
+
+
+def test_topology_export(user_client):
+    db.delete_all("link", "device")
+    create_from_file(user_client, "europe.xls")
+    app.export_topology(export_filename="test_export")
+    response = user_client.get("/stream_topology?format=csv&model=link")
+    rows = list(reader(response.data.decode("utf-8").splitlines()))
+    assert len(rows) == 50
+    assert {"source_name", "destination_name"} <= set(rows[0])
+    response = user_client.get("/stream_topology?format=csv&model=device")
+    header = next(reader(response.data.decode("utf-8").splitlines()))
+    assert "name" in header and not set(header) & set(db.private_properties)
+    for model in ("user", "unknown"):
+        response = user_client.get(f"/stream_topology?format=csv&model={model}")
+        assert response.status_code == 400
+    path = app.path / "files" / "spreadsheets" / "test_export.xlsx"
+    sheets = {model: list(rows) for model, rows in app.get_xlsx_sheets(path)}
+    path.unlink()
+    header, *devices = sheets["device"]
+    assert len(devices) == 33
+    names = {device[header.index("name")] for device in devices}
+    assert names == {device.name for device in db.fetch_all("device")}
+    assert len(sheets["link"]) == 50
+
+
+def test_topology_import_job(user_client):
+    db.delete_all("link", "device")
+    create_from_file(user_client, "europe.xls")
+    app.export_topology(export_filename="test_import")
+    path = app.path / "files" / "spreadsheets" / "test_import.xlsx"
+    db.delete_all("link", "device")
+    with open(path, "rb") as file:
+        data = {"form_type": "excel_import", "file": file, "job_id": "test-job"}
+        user_client.post("/import_topology", data=data)
+    path.unlink()
+    assert len(db.fetch_all("device")) == 33
+    assert len(db.fetch_all("link")) == 49
+    job = app.get_import_job("test-job")
+    assert job["status"] == "Topology successfully imported."
+    assert job["progress"] == {"device": 33, "link": 49} and not job["errors"]
+    links = (
+        "name,source_name,destination_name\n"
+        "l1,router5,router6\n"
+        "l2,router5,router0\n"
+    )
+    data = {
+        "form_type": "excel_import",
+        "file": (BytesIO(links.encode("utf-8")), "links_link.csv"),
+        "job_id": "csv-job",
+    }
+    user_client.post("/import_topology", data=data)
+    job = app.get_import_job("csv-job")
+    assert job["status"] == "Partial import (see logs)."
+    assert [(error["row"], error["name"]) for error in job["errors"]] == [(3, "l2")]
+    assert db.fetch("link", name="l1").destination.name == "router6"
+    data = {
+        "form_type": "excel_import",
+        "file": (BytesIO(b"corrupted"), "broken.xlsx"),
+        "job_id": "failed-job",
+    }
+    user_client.post("/import_topology", data=data)
+    assert app.get_import_job("failed-job")["status"] == "Failed"
+
+
+def test_search_index_escaping(user_client):
+    db.delete_all("device")
+    for name, configuration in (("escaped", "a_b"), ("unescaped", "axb")):
+        device = db.factory("device", name=name)
+        device.configuration = configuration
+    db.session.commit()
+    assert "configuration" in db.search_index_properties
+    constraint = db.search_constraint("configuration", "a_b")
+    assert [device.name for device in db.query("device").filter(constraint)] == [
+        "escaped"
+    ]
+
+
+def serialize(model, query):
+    def normalize(value):
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            return sorted(value)
+        return value
+
+    return {
+        instance.id: {
+            property: normalize(value)
+            for property, value in instance.to_dict(relation_names_only=True).items()
+        }
+        for instance in query
+    }
+
+
+def test_serializer_projection(user_client):
+    db.delete_all("link", "device")
+    create_from_file(user_client, "europe.xls")
+    for model in ("device", "link", "service", "workflow", "pool", "user"):
+        properties, relations = db.get_serializer(model)
+        db.session.expunge_all()
+        baseline = serialize(model, db.query(model))
+        db.session.expunge_all()
+        query = db.load_properties(db.query(model), model, properties)
+        relation_names = [relation for relation, _ in relations]
+        loader_options = db.get_loader_options(model, properties, relation_names, True)
+        projected = serialize(model, query.options(*loader_options))
+        assert baseline and projected == baseline
+    services = db.query("service").with_entities(models["service"].type).distinct()
+    assert len(services.all()) > 2